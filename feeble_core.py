@@ -0,0 +1,2810 @@
+""" GUI-free MediaMonkey to Discord pipeline shared by the window and headless builds.
+
+Importing this module pulls in neither customtkinter nor pystray, and PIL
+is only imported when a thumbnail is actually decoded.
+"""
+import threading
+import sys
+import urllib.parse
+import requests
+from requests.adapters import HTTPAdapter
+import re
+import time
+import json
+import os
+import io
+import hashlib
+import logging
+import logging.handlers
+import queue
+import struct
+import bisect
+import socket
+import socketserver
+import random
+import functools
+import difflib
+import unicodedata
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from array import array
+from collections import Counter, OrderedDict, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FutureTimeout
+from pypresence import Presence
+from pypresence.utils import get_ipc_path
+
+try:
+    import pythoncom
+    import win32com.client
+except ImportError:
+    # Non-Windows hosts can still drive PlayerWatcher from another source
+    pythoncom = None
+    win32com = None
+
+try:
+    import msvcrt
+    fcntl = None
+except ImportError:
+    import fcntl
+    msvcrt = None
+
+try:
+    # Optional: lets LocalArtProvider read covers embedded in the audio file
+    import mutagen
+except ImportError:
+    mutagen = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Front ends route this with setup_logging(); library code reports recoverable problems here, not on stdout
+log = logging.getLogger("feeble")
+
+# --- CONFIGURATION DEFAULTS ---
+DEFAULT_CONFIG = {
+    "client_id": "1462375131782447321",
+    "update_interval": 5,
+    "poll_interval_min": 1.0,
+    "poll_interval_max": 30.0,
+    "show_buttons": True,
+    "minimize_to_tray": True,
+    "auto_connect": True,
+    "start_minimized": True,
+    "art_cache_size": 500,
+    "art_cache_negative_ttl": 86400,
+    "measure_frame_latency": False,
+    "control_port": 47615,
+    "log_file": "feeble_presence.log",
+    "metrics_file": "",
+    "metrics_interval": 60,
+    "metrics_port": 0,
+    "metrics_trace": False,
+    "prefetch_depth": 5,
+    "prefetch_per_minute": 12,
+    "prefetch_kb_per_minute": 2048,
+    "presence_stats": False
+}
+
+# Type and inclusive bounds for every setting; None means unbounded
+CONFIG_SCHEMA = {
+    "client_id": (str, None, None),
+    "update_interval": (float, 0.5, 600),
+    "poll_interval_min": (float, 0.1, 60),
+    "poll_interval_max": (float, 1, 3600),
+    "show_buttons": (bool, None, None),
+    "minimize_to_tray": (bool, None, None),
+    "auto_connect": (bool, None, None),
+    "start_minimized": (bool, None, None),
+    "art_cache_size": (int, 1, 100000),
+    "art_cache_negative_ttl": (float, 0, 30 * 86400),
+    "measure_frame_latency": (bool, None, None),
+    "control_port": (int, 0, 65535),
+    "log_file": (str, None, None),
+    "metrics_file": (str, None, None),
+    "metrics_interval": (float, 1, 86400),
+    "metrics_port": (int, 0, 65535),
+    "metrics_trace": (bool, None, None),
+    "prefetch_depth": (int, 0, 100),
+    "prefetch_per_minute": (float, 0.1, 600),
+    "prefetch_kb_per_minute": (float, 16, 1024 * 1024),
+    "presence_stats": (bool, None, None),
+}
+
+def app_dir():
+    """ Directory holding config.json and the caches: next to the executable or these scripts, never the cwd. """
+    if getattr(sys, "frozen", False):
+        return os.path.dirname(sys.executable)
+    return os.path.dirname(os.path.abspath(__file__))
+
+def app_path(name):
+    """ Resolves a relative config path (log_file, art_cache, ...) against app_dir(). """
+    return os.path.join(app_dir(), name)
+
+def resource_path(relative_path):
+    """ Get absolute path to resource, works for dev and for PyInstaller """
+    try:
+        base_path = sys._MEIPASS
+    except Exception:
+        base_path = app_dir()
+    return os.path.join(base_path, relative_path)
+
+def validate_config(raw):
+    """ Returns (config, problems): defaults filled in and invalid values replaced by their defaults. """
+    config = DEFAULT_CONFIG.copy()
+    problems = []
+    for key, value in raw.items():
+        if key not in CONFIG_SCHEMA:
+            problems.append(f"{key}: unknown setting, ignored")
+            continue
+        kind, low, high = CONFIG_SCHEMA[key]
+        accepted = (int, float) if kind is float else kind
+        # bool is an int subclass, so true/false must not pass as a number
+        if not isinstance(value, accepted) or (kind is not bool and isinstance(value, bool)):
+            problems.append(f"{key}: expected {kind.__name__}, got {value!r}; using {DEFAULT_CONFIG[key]!r}")
+            continue
+        if low is not None and not low <= value <= high:
+            problems.append(f"{key}: {value!r} is outside {low}..{high}; using {DEFAULT_CONFIG[key]!r}")
+            continue
+        config[key] = value
+    if not config["client_id"]:
+        problems.append(f"client_id: empty; using {DEFAULT_CONFIG['client_id']!r}")
+        config["client_id"] = DEFAULT_CONFIG["client_id"]
+    return config, problems
+
+class ConfigStore:
+    """ config.json with schema validation, atomic writes and cheap change detection.
+
+    The file is only written when it is missing settings, and then only
+    the missing keys are added, so hand edits and unknown keys survive.
+    reload() costs one stat() when nothing changed. `data` is updated in
+    place, so everyone holding it sees reloaded values.
+    """
+    def __init__(self, path=None):
+        self.path = path or app_path("config.json")
+        self.data = DEFAULT_CONFIG.copy()
+        self.problems = []
+        self.stamp = None
+
+    def file_stamp(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def read(self):
+        with open(self.path, "r", encoding="utf-8") as f:
+            raw = json.load(f)
+        if not isinstance(raw, dict):
+            raise ValueError("top level is not an object")
+        return raw
+
+    def load(self):
+        self.stamp = self.file_stamp()
+        try:
+            raw = self.read()
+        except FileNotFoundError:
+            raw = {}
+        except ValueError as e:
+            # Leave a broken file alone so the user's edits aren't lost
+            self.problems = [f"config.json is not valid ({e}); using defaults"]
+            return self.data
+        config, self.problems = validate_config(raw)
+        self.data.update(config)
+        missing = {k: v for k, v in DEFAULT_CONFIG.items() if k not in raw}
+        if missing:
+            self.write(dict(raw, **missing))
+        return self.data
+
+    def write(self, values):
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(values, f, indent=4)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            self.problems.append(f"config.json not saved: {e}")
+        self.stamp = self.file_stamp()
+
+    def reload(self):
+        """ Re-reads the file if it changed on disk and returns {key: new value} for changed settings. """
+        stamp = self.file_stamp()
+        if stamp is None or stamp == self.stamp:
+            return {}
+        self.stamp = stamp
+        try:
+            raw = self.read()
+        except (OSError, ValueError) as e:
+            # Most likely caught mid-save by an editor; the next change retries
+            self.problems = [f"config.json is not valid ({e}); keeping current settings"]
+            return {}
+        config, self.problems = validate_config(raw)
+        changes = {k: v for k, v in config.items() if self.data.get(k) != v}
+        self.data.update(changes)
+        return changes
+
+def load_config(path=None):
+    return ConfigStore(path).load()
+
+def setup_logging(path, max_bytes=1024 * 1024, backups=3, console=False):
+    """ Sends the "feeble" logger to a rotating file (and optionally stderr). """
+    handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+    log.addHandler(handler)
+    if console:
+        log.addHandler(logging.StreamHandler())
+    log.setLevel(logging.INFO)
+    return log
+
+def process_footprint():
+    """ Returns "RSS x MB" for this process, for startup and soak reports. """
+    if psutil is None:
+        return "RSS unavailable"
+    return f"RSS {psutil.Process().memory_info().rss / (1024 * 1024):.1f} MB"
+
+# --- SINGLE INSTANCE ---
+def lock_file(f, blocking=True):
+    """ Takes an exclusive OS lock on an open file; the OS drops it when the process exits. """
+    if msvcrt:
+        f.seek(0)
+        # LK_LOCK retries for about 10 seconds before raising
+        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+    else:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+def unlock_file(f):
+    if msvcrt:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+@contextmanager
+def locked_file(path):
+    """ Serializes a read-merge-write of a shared file across processes through `path`. """
+    with open(path, "a+") as f:
+        lock_file(f)
+        try:
+            yield
+        finally:
+            unlock_file(f)
+
+class InstanceLock:
+    """ Machine-wide "one bridge at a time" lock, shared by the window and the headless daemon.
+
+    Held for the life of the process. Since the OS releases it when the
+    process dies, a crash never leaves a stale lock behind.
+    """
+    FILE = "feeble_presence.lock"
+
+    def __init__(self, path=None):
+        self.path = path or app_path(self.FILE)
+        self.file = None
+
+    def acquire(self):
+        f = open(self.path, "a+")
+        try:
+            lock_file(f, blocking=False)
+        except OSError:
+            f.close()
+            return False
+        self.file = f
+        return True
+
+    def release(self):
+        if self.file:
+            unlock_file(self.file)
+            self.file.close()
+            self.file = None
+
+def snapshot_fields(snap):
+    """ The JSON-safe part of a BridgeSnapshot (the decoded artwork stays behind). """
+    return {"running": snap.running, "status": snap.status, "title": snap.title, "artist": snap.artist,
+            "art_key": snap.art_key}
+
+class StateFeed:
+    """ Fans bridge state out to read-only "watch" clients on the control socket. """
+    def __init__(self, backlog=32):
+        self.backlog = backlog
+        self.lock = threading.Lock()
+        self.watchers = []
+        self.last = None
+        self.closed = False
+
+    def publish(self, state):
+        with self.lock:
+            self.last = state
+            for q in self.watchers:
+                if q.qsize() < self.backlog:
+                    q.put(state)
+
+    def subscribe(self):
+        q = queue.Queue()
+        with self.lock:
+            self.watchers.append(q)
+            if self.last is not None:
+                q.put(self.last)
+            if self.closed:
+                q.put(None)
+        return q
+
+    def unsubscribe(self, q):
+        with self.lock:
+            self.watchers.remove(q)
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            for q in self.watchers:
+                q.put(None)
+
+class ControlHandler(socketserver.StreamRequestHandler):
+    # A client that never sends its line (or stops reading a watch) cannot hold up shutdown
+    timeout = 5.0
+
+    def handle(self):
+        command = self.rfile.readline(256).decode("utf-8", "replace").strip()
+        if command == "watch":
+            self.watch()
+            return
+        reply = self.server.bridge.handle_command(command)
+        self.wfile.write((json.dumps(reply) + "\n").encode("utf-8"))
+
+    def watch(self):
+        """ Streams one JSON line per state change until the client or the server goes away. """
+        feed = self.server.bridge.feed
+        q = feed.subscribe()
+        try:
+            while True:
+                state = q.get()
+                if state is None:
+                    return
+                self.wfile.write((json.dumps(state) + "\n").encode("utf-8"))
+                self.wfile.flush()
+        except OSError:
+            pass
+        finally:
+            feed.unsubscribe(q)
+
+class ControlServer(socketserver.ThreadingTCPServer):
+    """ One-line command socket of the running instance; `bridge` needs handle_command() and a feed.
+
+    stop() waits for requests in flight, so a reply (e.g. to quit) is
+    written before the process exits.
+    """
+    # Rebind through TIME_WAIT after a restart; on Windows SO_REUSEADDR would let a second process steal the port
+    allow_reuse_address = os.name != "nt"
+
+    def __init__(self, port, bridge):
+        # Loopback only: the socket accepts commands from anything on this machine
+        super().__init__(("127.0.0.1", port), ControlHandler)
+        self.bridge = bridge
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="ControlSocket", daemon=True).start()
+
+    def stop(self):
+        self.bridge.feed.close()
+        self.shutdown()
+        self.server_close()
+
+def send_command(port, command, timeout=2.0):
+    """ Sends one command to a running instance and returns its JSON reply. """
+    with socket.create_connection(("127.0.0.1", port), timeout=timeout) as sock:
+        sock.sendall(command.encode("utf-8") + b"\n")
+        return json.loads(sock.makefile("r", encoding="utf-8").readline())
+
+def watch_instance(port, timeout=2.0):
+    """ Yields the running instance's state dicts as they change; ends when it exits. """
+    with socket.create_connection(("127.0.0.1", port), timeout=timeout) as sock:
+        sock.settimeout(None)
+        sock.sendall(b"watch\n")
+        for line in sock.makefile("r", encoding="utf-8"):
+            yield json.loads(line)
+
+# --- METRICS ---
+class Metrics:
+    """ Thread-safe counters, latency histograms, recovered exceptions and optional spans.
+
+    Histograms keep lifetime count/total/max plus the most recent samples,
+    which the percentiles are computed from. Stats that components already
+    keep (the publisher, the art resolver, the endpoints) are registered
+    with add_source() and read at snapshot time instead of being copied.
+    With trace=True every span() is also kept in a bounded ring.
+    """
+    RECENT_SAMPLES = 1024
+
+    def __init__(self, trace=False, max_spans=512):
+        self.trace = trace
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.errors = {}
+        self.sources = {}
+        self.spans = deque(maxlen=max_spans)
+        self.span_seq = 0
+        self.started = time.time()
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name, seconds):
+        with self.lock:
+            h = self.histograms.get(name)
+            if h is None:
+                h = self.histograms[name] = {"count": 0, "total": 0.0, "max": 0.0, "recent": deque(maxlen=self.RECENT_SAMPLES)}
+            h["count"] += 1
+            h["total"] += seconds
+            h["max"] = max(h["max"], seconds)
+            h["recent"].append(seconds)
+
+    def exception(self, stage, error):
+        """ Counts an exception the pipeline recovered from instead of raising. """
+        with self.lock:
+            entry = self.errors.setdefault(stage, {"count": 0, "last": None})
+            entry["count"] += 1
+            entry["last"] = f"{type(error).__name__}: {error}"[:200]
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """ Times the block into the `name` histogram, and records a span when tracing. """
+        start = time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            self.observe(name, elapsed)
+            if self.trace:
+                record = dict(attrs, name=name, at=round(time.time() - elapsed, 3), ms=round(elapsed * 1000, 3),
+                              thread=threading.current_thread().name)
+                if error is not None:
+                    record["error"] = type(error).__name__
+                with self.lock:
+                    self.span_seq += 1
+                    record["seq"] = self.span_seq
+                    self.spans.append(record)
+
+    def add_source(self, name, read):
+        """ Registers a callable whose JSON-able result is included in every snapshot. """
+        self.sources[name] = read
+
+    @staticmethod
+    def summarize(h):
+        recent = sorted(h["recent"])
+        pick = lambda q: round(recent[min(len(recent) - 1, int(len(recent) * q))] * 1000, 3)
+        return {
+            "count": h["count"],
+            "mean_ms": round(h["total"] / h["count"] * 1000, 3),
+            "p50_ms": pick(0.5),
+            "p95_ms": pick(0.95),
+            "p99_ms": pick(0.99),
+            "max_ms": round(h["max"] * 1000, 3),
+        }
+
+    def snapshot(self, spans_after=None):
+        """ Returns everything as one JSON-able dict; spans (seq > spans_after) only when asked for. """
+        with self.lock:
+            snap = {
+                "time": round(time.time(), 3),
+                "uptime": round(time.time() - self.started, 1),
+                "counters": dict(self.counters),
+                "histograms": {name: self.summarize(h) for name, h in self.histograms.items()},
+                "exceptions": {stage: dict(e) for stage, e in self.errors.items()},
+            }
+            if spans_after is not None:
+                snap["spans"] = [r for r in self.spans if r["seq"] > spans_after]
+        sources = {}
+        for name, read in list(self.sources.items()):
+            try:
+                sources[name] = read()
+            except Exception as e:
+                sources[name] = {"error": str(e)}
+        snap["sources"] = sources
+        return snap
+
+class MetricsFileExporter(threading.Thread):
+    """ Appends a snapshot to a JSONL file every `interval` seconds, plus a final one on stop(). """
+    def __init__(self, metrics, path, interval=60.0):
+        super().__init__(name="MetricsExporter", daemon=True)
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.last_span = 0
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.write()
+
+    def write(self):
+        snap = self.metrics.snapshot(spans_after=self.last_span if self.metrics.trace else None)
+        if snap.get("spans"):
+            self.last_span = snap["spans"][-1]["seq"]
+        try:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(snap) + "\n")
+        except OSError as e:
+            self.metrics.exception("metrics_export", e)
+
+    def stop(self):
+        self.stopped.set()
+        self.write()
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        if path == "/metrics":
+            snap = self.server.metrics.snapshot()
+        elif path == "/spans":
+            snap = self.server.metrics.snapshot(spans_after=0)
+        else:
+            self.send_error(404)
+            return
+        body = json.dumps(snap).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class MetricsServer(ThreadingHTTPServer):
+    """ Serves GET /metrics and /spans as JSON on 127.0.0.1:port. """
+    daemon_threads = True
+    allow_reuse_address = ControlServer.allow_reuse_address
+
+    def __init__(self, port, metrics):
+        super().__init__(("127.0.0.1", port), MetricsHandler)
+        self.metrics = metrics
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="MetricsServer", daemon=True).start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+# --- ALBUM ART CACHE ---
+class ArtCache:
+    """ Persistent LRU cache of resolved artwork, keyed by normalized (artist, album).
+
+    Each entry holds the artwork URL used for Discord and a 200x200 thumbnail
+    stored on disk. Lookups that found nothing are kept as negative entries
+    (url None) and expire after negative_ttl seconds so they get retried.
+    The most recently used thumbnails are also kept decoded in memory.
+    """
+    INDEX_FILE = "index.json"
+    THUMB_SIZE = (200, 200)
+
+    def __init__(self, directory, max_entries=500, negative_ttl=86400, memory_thumbs=32, metrics=None):
+        self.directory = directory
+        self.metrics = metrics or Metrics()
+        self.max_entries = max(1, int(max_entries))
+        self.negative_ttl = negative_ttl
+        self.memory_thumbs = memory_thumbs
+        self.entries = OrderedDict()
+        self.thumbs = OrderedDict()
+        # Keys evicted since the last save, so merging another process's index doesn't bring them back
+        self.evicted = set()
+        self.lock = threading.Lock()
+        self.dirty = False
+        self.stats = {"hits": 0, "negative_hits": 0, "misses": 0}
+        os.makedirs(directory, exist_ok=True)
+        self.load()
+
+    @staticmethod
+    def make_key(artist, album):
+        return f"{artist.casefold()}|{album.casefold()}"
+
+    def read_index(self):
+        try:
+            with open(os.path.join(self.directory, self.INDEX_FILE), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def load(self):
+        # Oldest use first, so the OrderedDict tail is the most recently used entry
+        for key, entry in sorted(self.read_index().items(), key=lambda kv: kv[1].get("used", 0)):
+            self.entries[key] = entry
+
+    def merge(self, stored):
+        """ Adopts entries another process (e.g. a bulk prefetch) saved since we loaded. Caller holds the lock. """
+        changed = False
+        for key, entry in stored.items():
+            mine = self.entries.get(key)
+            if key in self.evicted or (mine is not None and mine.get("time", 0) >= entry.get("time", 0)):
+                continue
+            self.entries[key] = entry
+            changed = True
+        if changed:
+            self.entries = OrderedDict(sorted(self.entries.items(), key=lambda kv: kv[1].get("used", 0)))
+            while len(self.entries) > self.max_entries:
+                dropped_key, _ = self.entries.popitem(last=False)
+                self.thumbs.pop(dropped_key, None)
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+        path = os.path.join(self.directory, self.INDEX_FILE)
+        tmp_path = f"{path}.tmp"
+        try:
+            with locked_file(f"{path}.lock"):
+                stored = self.read_index()
+                with self.lock:
+                    self.merge(stored)
+                    data = json.dumps(self.entries, indent=1)
+                    written_evictions = set(self.evicted)
+                    # Changes from here on mark the cache dirty again
+                    self.dirty = False
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            with self.lock:
+                self.evicted -= written_evictions
+        except OSError as e:
+            # Keep the changes (and evictions) pending, so the next save retries them
+            with self.lock:
+                self.dirty = True
+            log.warning("Art cache save failed: %s", e)
+            self.metrics.exception("art_cache_save", e)
+
+    def get(self, key):
+        """ Returns the cached entry, or None on a miss or an expired negative entry. """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            now = time.time()
+            if entry["url"] is None and now - entry["time"] > self.negative_ttl:
+                del self.entries[key]
+                self.evicted.add(key)
+                self.dirty = True
+                self.stats["misses"] += 1
+                return None
+            self.stats["hits" if entry["url"] else "negative_hits"] += 1
+            entry["used"] = now
+            self.entries.move_to_end(key)
+            self.dirty = True
+            return entry
+
+    def contains(self, key):
+        """ True if get() would hit; unlike get() it leaves the stats and LRU order alone. """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return False
+            return entry["url"] is not None or time.time() - entry["time"] <= self.negative_ttl
+
+    def peek_url(self, key):
+        """ The cached artwork URL, or None on a miss or a negative entry; leaves the stats and LRU order alone. """
+        with self.lock:
+            entry = self.entries.get(key)
+            return entry["url"] if entry else None
+
+    def metrics(self):
+        with self.lock:
+            lookups = sum(self.stats.values())
+            hits = self.stats["hits"] + self.stats["negative_hits"]
+            return dict(self.stats, entries=len(self.entries), thumbs_in_memory=len(self.thumbs),
+                        hit_ratio=round(hits / lookups, 3) if lookups else None)
+
+    def load_thumbnail(self, key, entry):
+        with self.lock:
+            thumb = self.thumbs.get(key)
+            if thumb is not None:
+                self.thumbs.move_to_end(key)
+                return thumb
+        if not entry.get("thumb"):
+            return None
+        from PIL import Image
+        try:
+            with Image.open(os.path.join(self.directory, entry["thumb"])) as img:
+                thumb = img.convert("RGB")
+        except OSError:
+            return None
+        self.remember(key, thumb)
+        return thumb
+
+    def remember(self, key, thumb):
+        """ Keeps a decoded thumbnail in the in-memory tier. """
+        with self.lock:
+            self.thumbs[key] = thumb
+            self.thumbs.move_to_end(key)
+            while len(self.thumbs) > self.memory_thumbs:
+                self.thumbs.popitem(last=False)
+
+    def put(self, key, url, thumb=None):
+        """ Stores a positive entry; thumb should already be THUMB_SIZE (see decode_thumbnail). """
+        thumb_name = None
+        if thumb is not None:
+            self.remember(key, thumb)
+            thumb_name = hashlib.sha1(key.encode("utf-8")).hexdigest() + ".jpg"
+            try:
+                thumb.save(os.path.join(self.directory, thumb_name), "JPEG", quality=90)
+            except OSError:
+                thumb_name = None
+        self._store(key, {"url": url, "thumb": thumb_name})
+
+    @classmethod
+    def decode_thumbnail(cls, data):
+        """ Decodes image bytes straight to THUMB_SIZE without keeping the full-size image.
+
+        For JPEGs, draft() makes the decoder scale by 1/2, 1/4 or 1/8 while
+        decoding, so a 512x512 cover is never materialized at full resolution.
+        """
+        from PIL import Image
+        with Image.open(io.BytesIO(data)) as img:
+            img.draft("RGB", cls.THUMB_SIZE)
+            thumb = img.convert("RGB")
+        if thumb.size != cls.THUMB_SIZE:
+            thumb = thumb.resize(cls.THUMB_SIZE, Image.LANCZOS)
+        return thumb
+
+    def put_negative(self, key):
+        self._store(key, {"url": None, "thumb": None})
+
+    def drop(self, key):
+        """ Forgets an entry, e.g. one whose URL stopped downloading, so the next lookup resolves it again. """
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                return
+            self.thumbs.pop(key, None)
+            self.evicted.add(key)
+            self.dirty = True
+        if entry.get("thumb"):
+            try:
+                os.remove(os.path.join(self.directory, entry["thumb"]))
+            except OSError:
+                pass
+        self.save()
+
+    def _store(self, key, entry):
+        now = time.time()
+        entry["time"] = now
+        entry["used"] = now
+        evicted = []
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old and old.get("thumb") and old["thumb"] != entry["thumb"]:
+                evicted.append(old["thumb"])
+            self.entries[key] = entry
+            self.evicted.discard(key)
+            while len(self.entries) > self.max_entries:
+                dropped_key, dropped = self.entries.popitem(last=False)
+                self.thumbs.pop(dropped_key, None)
+                self.evicted.add(dropped_key)
+                if dropped.get("thumb"):
+                    evicted.append(dropped["thumb"])
+            self.dirty = True
+        for name in evicted:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+        self.save()
+
+# --- HTTP CLIENT ---
+class ResponseTooLarge(requests.RequestException):
+    pass
+
+class HttpClient:
+    """ Shared keep-alive session for artwork requests.
+
+    Connections are pooled per host and bodies larger than max_bytes are
+    refused. Failed connections, timeouts and retryable statuses are tried
+    again with exponential backoff. total_timeout covers the whole call:
+    connecting, waiting for headers, retries with their backoff, and reading
+    the body. Each attempt's (connect, read) timeout is cut to the time left,
+    and a retry that could not finish in time is not started.
+    """
+    # Answers worth asking again; a 429 or 503 may say how long to wait in Retry-After
+    RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+    def __init__(self, connect_timeout=3.05, read_timeout=5.0, total_timeout=15.0,
+                 retries=2, backoff=0.5, max_bytes=4 * 1024 * 1024, pool_size=4):
+        self.timeout = (connect_timeout, read_timeout)
+        self.total_timeout = total_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_bytes = max_bytes
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers["User-Agent"] = "FeeblePresence/1.5"
+        # Body bytes downloaded so far; ArtPrefetcher charges its bandwidth budget from this
+        self.bytes_read = 0
+
+    def get_bytes(self, url, params=None):
+        deadline = time.monotonic() + self.total_timeout
+        for attempt in range(self.retries + 1):
+            delay = self.backoff * 2 ** attempt
+            last = attempt == self.retries
+            try:
+                response = self.session.get(url, params=params, timeout=self.attempt_timeout(url, deadline), stream=True)
+            except (requests.ConnectionError, requests.Timeout):
+                if last or time.monotonic() + delay >= deadline:
+                    raise
+            else:
+                with response:
+                    retry = not last and response.status_code in self.RETRY_STATUSES
+                    if retry:
+                        retry_after = response.headers.get("Retry-After", "")
+                        if retry_after.isdigit():
+                            delay = max(delay, int(retry_after))
+                        retry = time.monotonic() + delay < deadline
+                    if not retry:
+                        return self.read_body(url, response, deadline)
+            time.sleep(delay)
+
+    def attempt_timeout(self, url, deadline):
+        """ The (connect, read) timeout for the next attempt, cut to what is left of the deadline. """
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise requests.Timeout(f"{url}: exceeded {self.total_timeout}s")
+        return tuple(min(t, remaining) for t in self.timeout)
+
+    def read_body(self, url, response, deadline):
+        response.raise_for_status()
+        length = response.headers.get("Content-Length")
+        if length and length.isdigit() and int(length) > self.max_bytes:
+            raise ResponseTooLarge(f"{url}: {length} bytes")
+        body = bytearray()
+        for chunk in response.iter_content(64 * 1024):
+            body += chunk
+            self.bytes_read += len(chunk)
+            if len(body) > self.max_bytes:
+                raise ResponseTooLarge(f"{url}: over {self.max_bytes} bytes")
+            if time.monotonic() > deadline:
+                raise requests.Timeout(f"{url}: exceeded {self.total_timeout}s")
+        return bytes(body)
+
+    def get_json(self, url, params=None):
+        return json.loads(self.get_bytes(url, params))
+
+    def close(self):
+        self.session.close()
+
+# --- ARTWORK MATCHING ---
+# Bracketed or dash-separated qualifiers naming a reissue of the same album, which keeps its cover
+_REISSUE = r"deluxe|edition|remaster(?:ed)?|expanded|anniversary|reissue|bonus|explicit"
+_EDITION = re.compile(
+    rf"\s*(?:[\(\[][^\)\]]*\b(?:{_REISSUE})\b[^\)\]]*[\)\]]|-\s+[^-]*\b(?:{_REISSUE})\b.*$)",
+    re.I
+)
+# Live, karaoke and similar versions have covers of their own, so a qualifier naming one is kept
+_VARIANT = re.compile(
+    r"\b(?:live|karaoke|acoustic|instrumental|remix(?:es|ed)?|demos?|unplugged|tribute|covers?|taylor'?s version)\b",
+    re.I
+)
+_FEATURING = re.compile(r"\s+(?:feat\.?|ft\.?|featuring)\s.*$", re.I)
+_NON_WORD = re.compile(r"[^\w]+")
+_LEADING_THE = re.compile(r"^the\s+")
+# Numbers and roman numerals tell volumes and sequels apart ("IV" vs "II", "Greatest Hits" vs "Greatest Hits 2")
+_NUMERAL = re.compile(r"\d+|(?=[ivx])x{0,3}(?:ix|iv|v?i{0,3})")
+
+@functools.lru_cache(maxsize=4096)
+def normalize_name(text, artist=False):
+    """ Folds an artist or album name to the form used for matching.
+
+    Drops diacritics, case, punctuation, a leading "The", reissue
+    qualifiers like "(Deluxe)" or "- 2011 Remaster", and for artists any
+    "feat." guest list; "&" reads as "and". Other qualifiers, such as
+    "(Live)" or "(Blue Album)", stay and tell albums apart.
+    """
+    text = _EDITION.sub(lambda m: m.group(0) if _VARIANT.search(m.group(0)) else "", text)
+    if artist:
+        text = _FEATURING.sub("", text)
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c)).casefold().replace("&", " and ")
+    text = _NON_WORD.sub(" ", text).replace("_", " ").strip()
+    return _LEADING_THE.sub("", text)
+
+def name_similarity(a, b, typo_ratio=0.8):
+    """ 0..1 similarity of two normalized names.
+
+    Tokens pair up when equal or when one looks like a typo of the other
+    (a typo pair counts its character similarity), and the score is the
+    Dice coefficient of the pairs, so an added or missing word always
+    costs. Names whose numbers or roman numerals differ score 0.
+    """
+    if a == b:
+        return 1.0
+    if not a or not b:
+        return 0.0
+    tokens_a, tokens_b = a.split(), b.split()
+    if {t for t in tokens_a if _NUMERAL.fullmatch(t)} != {t for t in tokens_b if _NUMERAL.fullmatch(t)}:
+        return 0.0
+    unpaired = list(tokens_b)
+    paired = 0.0
+    for token in tokens_a:
+        if token in unpaired:
+            unpaired.remove(token)
+            paired += 1
+            continue
+        ratios = [(difflib.SequenceMatcher(None, token, other).ratio(), other) for other in unpaired]
+        ratio, other = max(ratios, default=(0.0, None))
+        if ratio >= typo_ratio:
+            unpaired.remove(other)
+            paired += ratio
+    return 2 * paired / (len(tokens_a) + len(tokens_b))
+
+class AlbumMatcher:
+    """ Picks the provider search result that best matches the library's artist and album.
+
+    Each candidate scores ARTIST_WEIGHT * artist similarity plus the rest
+    for album similarity. Candidates below MIN_SCORE, or whose album is
+    below MIN_ALBUM, are rejected, so a search that only found something
+    else reports a miss instead of a wrong cover. MIN_ALBUM is strict
+    because a wrong match is remembered in the alias index: one word out
+    of three different ("Blue Album" vs "Green Album") must not pass.
+    """
+    ARTIST_WEIGHT = 0.4
+    MIN_SCORE = 0.7
+    MIN_ALBUM = 0.85
+
+    def __init__(self):
+        self.stats = {"searches": 0, "candidates": 0, "rejected": 0, "reranked": 0}
+
+    def score(self, artist, album, cand_artist, cand_album):
+        artist_sim = name_similarity(normalize_name(artist, True), normalize_name(cand_artist, True))
+        album_sim = name_similarity(normalize_name(album), normalize_name(cand_album))
+        if album_sim < self.MIN_ALBUM:
+            return 0.0
+        return self.ARTIST_WEIGHT * artist_sim + (1 - self.ARTIST_WEIGHT) * album_sim
+
+    def best(self, artist, album, candidates):
+        """ candidates: (artist, album, item) tuples; returns the best item or None. """
+        self.stats["searches"] += 1
+        self.stats["candidates"] += len(candidates)
+        scored = [(self.score(artist, album, a, b), i) for i, (a, b, _) in enumerate(candidates)]
+        score, index = max(scored, default=(0.0, None))
+        if score < self.MIN_SCORE:
+            self.stats["rejected"] += 1
+            return None
+        if index:
+            self.stats["reranked"] += 1
+        return candidates[index][2]
+
+class AliasIndex:
+    """ Persistent map from normalized (artist, album) to the provider match it resolved to.
+
+    Unlike ArtCache keys, the normalized key folds spellings together, so
+    "Beyoncé - Lemonade (Deluxe)" is answered by the match found for
+    "Beyonce - Lemonade", and the index (small, no thumbnails) outlives
+    cache evictions. Aliases older than MAX_AGE count as misses, so a new
+    search re-validates them, and remove() drops one whose URL went dead.
+    """
+    FILE = "aliases.json"
+    MAX_AGE = 30 * 86400
+
+    def __init__(self, directory):
+        self.path = os.path.join(directory, self.FILE)
+        self.aliases = {}
+        self.removed = set()
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "stored": 0, "removed": 0}
+        self.aliases = self.read()
+
+    @staticmethod
+    def make_key(artist, album):
+        return f"{normalize_name(artist, True)}|{normalize_name(album)}"
+
+    def get(self, artist, album):
+        with self.lock:
+            alias = self.aliases.get(self.make_key(artist, album))
+            # Aliases from before "time" was stored count as old
+            if alias and time.time() - alias.get("time", 0) > self.MAX_AGE:
+                self.stats["expired"] += 1
+                alias = None
+            self.stats["hits" if alias else "misses"] += 1
+            return alias
+
+    def read(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def put(self, artist, album, result):
+        key = self.make_key(artist, album)
+        alias = {"ref": result.ref, "url": result.url, "source": result.source, "time": time.time()}
+        with self.lock:
+            self.aliases[key] = alias
+            self.removed.discard(key)
+            self.stats["stored"] += 1
+        self.save()
+
+    def remove(self, artist, album, url=None):
+        """ Forgets an alias; with url, only while it still points there (another lookup may have refreshed it). """
+        key = self.make_key(artist, album)
+        with self.lock:
+            alias = self.aliases.get(key)
+            if alias is None or (url is not None and alias["url"] != url):
+                return
+            del self.aliases[key]
+            self.removed.add(key)
+            self.stats["removed"] += 1
+        self.save()
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with locked_file(f"{self.path}.lock"):
+                # Keep what other processes stored since we loaded, except what we removed
+                stored = self.read()
+                with self.lock:
+                    for key in self.removed:
+                        stored.pop(key, None)
+                    self.removed.clear()
+                    stored.update(self.aliases)
+                    self.aliases = stored
+                    data = json.dumps(stored, indent=1)
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.write(data)
+                os.replace(tmp_path, self.path)
+        except OSError as e:
+            log.warning("Alias index save failed: %s", e)
+
+    def metrics(self):
+        with self.lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return dict(self.stats, entries=len(self.aliases),
+                        hit_ratio=round(self.stats["hits"] / lookups, 3) if lookups else None)
+
+# --- ARTWORK PROVIDERS ---
+# ref is the provider's own ID for the matched album, e.g. "itunes:1440833098"
+ArtResult = namedtuple("ArtResult", "url data source ref", defaults=(None,))
+
+class LocalArtProvider:
+    """ Reads the cover embedded in the song file, or a sidecar image next to it.
+
+    Local results carry image bytes but no URL, since Discord can only show
+    artwork it can download itself.
+    """
+    name = "local"
+    SIDECAR_NAMES = (
+        "folder.jpg", "cover.jpg", "front.jpg", "albumart.jpg",
+        "folder.png", "cover.png", "front.png"
+    )
+
+    def lookup(self, artist, album, path):
+        if not path:
+            return None
+        data = self.embedded_art(path) or self.sidecar_art(os.path.dirname(path))
+        return ArtResult(None, data, self.name) if data else None
+
+    def embedded_art(self, path):
+        if mutagen is None:
+            return None
+        try:
+            audio = mutagen.File(path)
+        except Exception:
+            return None
+        if audio is None:
+            return None
+        pictures = getattr(audio, "pictures", None)
+        if pictures:
+            return pictures[0].data
+        tags = audio.tags
+        if tags is None:
+            return None
+        if hasattr(tags, "getall"):
+            frames = tags.getall("APIC")
+            # Prefer the front cover (picture type 3) when several are embedded
+            frames.sort(key=lambda frame: frame.type != 3)
+            return frames[0].data if frames else None
+        covers = tags.get("covr")
+        return bytes(covers[0]) if covers else None
+
+    def sidecar_art(self, folder):
+        try:
+            names = {entry.name.lower(): entry.path for entry in os.scandir(folder) if entry.is_file()}
+        except OSError:
+            return None
+        for name in self.SIDECAR_NAMES:
+            if name in names:
+                with open(names[name], "rb") as f:
+                    return f.read()
+        return None
+
+class ItunesArtProvider:
+    name = "itunes"
+    CANDIDATES = 5
+
+    def __init__(self, http, base_url="https://itunes.apple.com", matcher=None):
+        self.http = http
+        self.base_url = base_url
+        self.matcher = matcher or AlbumMatcher()
+
+    def lookup(self, artist, album, path):
+        data = self.http.get_json(f"{self.base_url}/search", params={
+            "term": f"{artist} {album}", "media": "music", "entity": "album", "limit": self.CANDIDATES
+        })
+        best = self.matcher.best(artist, album, [
+            (r.get("artistName", ""), r.get("collectionName", ""), r) for r in data.get("results", [])
+        ])
+        if best is None:
+            return None
+        return ArtResult(best["artworkUrl100"].replace("100x100", "512x512"), None, self.name,
+                         f"itunes:{best.get('collectionId')}")
+
+class DeezerArtProvider:
+    name = "deezer"
+    CANDIDATES = 5
+
+    def __init__(self, http, base_url="https://api.deezer.com", matcher=None):
+        self.http = http
+        self.base_url = base_url
+        self.matcher = matcher or AlbumMatcher()
+
+    def lookup(self, artist, album, path):
+        data = self.http.get_json(f"{self.base_url}/search/album", params={
+            "q": f'artist:"{artist}" album:"{album}"', "limit": self.CANDIDATES
+        })
+        if "error" in data:
+            raise requests.RequestException(f"deezer: {data['error']}")
+        best = self.matcher.best(artist, album, [
+            (r.get("artist", {}).get("name", ""), r.get("title", ""), r) for r in data.get("data") or []
+        ])
+        if best is None:
+            return None
+        return ArtResult(best["cover_big"], None, self.name, f"deezer:{best.get('id')}")
+
+class ArtResolver:
+    """ Runs artwork providers fastest-first and keeps per-provider statistics.
+
+    Local providers are tried in order on the calling thread. Remote
+    providers are ranked by hit rate over average latency and raced in
+    batches of race_width; the first result with a URL wins.
+    resolve_remote() returns None only when every provider answered with a
+    clean miss, and re-raises when any of them failed without another one
+    finding the album, so callers can tell "no artwork exists" from "a
+    source could not be asked". With an AliasIndex,
+    albums matched before under any spelling are answered without a search.
+    """
+    def __init__(self, local_providers, remote_providers, race_width=2, timeout=10.0, aliases=None):
+        self.local = list(local_providers)
+        self.remote = list(remote_providers)
+        self.aliases = aliases
+        self.race_width = race_width
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.stats = {
+            p.name: {"attempts": 0, "hits": 0, "errors": 0, "latency": None}
+            for p in self.local + self.remote
+        }
+        self.executor = ThreadPoolExecutor(
+            max_workers=max(1, len(self.remote)) * 2, thread_name_prefix="ArtProvider"
+        )
+
+    def score(self, provider):
+        s = self.stats[provider.name]
+        hit_rate = (s["hits"] + 1) / (s["attempts"] + 2)
+        return hit_rate / (s["latency"] or 1.0)
+
+    def ranked(self):
+        with self.lock:
+            return sorted(self.remote, key=self.score, reverse=True)
+
+    def run(self, provider, artist, album, path):
+        start = time.perf_counter()
+        result = error = None
+        try:
+            result = provider.lookup(artist, album, path)
+        except Exception as e:
+            error = e
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            s = self.stats[provider.name]
+            s["attempts"] += 1
+            s["latency"] = elapsed if s["latency"] is None else 0.8 * s["latency"] + 0.2 * elapsed
+            if error is not None:
+                s["errors"] += 1
+            elif result is not None:
+                s["hits"] += 1
+        if error is not None:
+            raise error
+        return result
+
+    def resolve_local(self, artist, album, path):
+        for provider in self.local:
+            try:
+                result = self.run(provider, artist, album, path)
+            except Exception:
+                continue
+            if result is not None:
+                return result
+        return None
+
+    def resolve_remote(self, artist, album, path):
+        alias = self.aliases.get(artist, album) if self.aliases else None
+        if alias:
+            return ArtResult(alias["url"], None, alias["source"], alias["ref"])
+        result = self.search_remote(artist, album, path)
+        if result is not None and result.ref and self.aliases:
+            self.aliases.put(artist, album, result)
+        return result
+
+    def forget(self, artist, album, url):
+        """ Drops the alias that answered with `url` after it failed to download, so the next lookup searches again. """
+        if self.aliases:
+            self.aliases.remove(artist, album, url)
+
+    def search_remote(self, artist, album, path):
+        providers = self.ranked()
+        failures = 0
+        last_error = None
+        for i in range(0, len(providers), self.race_width):
+            futures = [
+                self.executor.submit(self.run, provider, artist, album, path)
+                for provider in providers[i:i + self.race_width]
+            ]
+            try:
+                for future in as_completed(futures, timeout=self.timeout):
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        failures += 1
+                        last_error = e
+                        continue
+                    if result is not None and result.url:
+                        for other in futures:
+                            other.cancel()
+                        return result
+            except FutureTimeout as e:
+                failures += sum(1 for f in futures if not f.done())
+                last_error = e
+        if failures:
+            raise last_error
+        return None
+
+    def summary(self):
+        with self.lock:
+            parts = []
+            for name, s in self.stats.items():
+                if s["attempts"]:
+                    latency_ms = (s["latency"] or 0) * 1000
+                    parts.append(f"{name} {s['hits']}/{s['attempts']} hits, {latency_ms:.0f} ms")
+            return "; ".join(parts) or "no lookups"
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+# --- ARTWORK FETCH EXECUTOR ---
+class ArtFetcher:
+    """ Bounded pool for artwork lookups with stale-result protection.
+
+    Every request() starts a new generation: lookups that have not started
+    yet are cancelled and results from older generations are discarded.
+    A request for an album that is already being looked up joins that
+    lookup instead of starting another one.
+    """
+    def __init__(self, resolve, deliver, max_workers=2):
+        self.resolve = resolve
+        self.deliver = deliver
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ArtFetch")
+        # Re-entrant: cancel() runs _finished() synchronously while request() holds the lock
+        self.lock = threading.RLock()
+        self.generation = 0
+        self.in_flight = {}
+
+    def request(self, cache_key, args, token):
+        """ Resolves resolve(*args) and calls deliver(token, *result) if still current. """
+        with self.lock:
+            self.generation += 1
+            generation = self.generation
+            for key, future in list(self.in_flight.items()):
+                if key != cache_key:
+                    future.cancel()
+            future = self.in_flight.get(cache_key)
+            if future is None:
+                future = self.executor.submit(self.resolve, *args)
+                self.in_flight[cache_key] = future
+                future.add_done_callback(lambda f: self._finished(cache_key, f))
+        future.add_done_callback(lambda f: self._deliver(generation, token, f))
+
+    def _finished(self, cache_key, future):
+        with self.lock:
+            if self.in_flight.get(cache_key) is future:
+                del self.in_flight[cache_key]
+
+    def _deliver(self, generation, token, future):
+        if future.cancelled() or generation != self.generation:
+            return
+        try:
+            result = future.result()
+        except Exception:
+            return
+        self.deliver(token, *result)
+
+    def busy(self):
+        return bool(self.in_flight)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+class ArtPrefetcher(threading.Thread):
+    """ Low-priority artwork warmer for albums that are about to play.
+
+    Lookups run one at a time on this thread, only while busy() reports
+    that no foreground lookup is waiting, and within a budget of `rate`
+    lookups and `byte_budget` downloaded bytes per `period` seconds.
+    Albums already in the cache are skipped without a lookup. The thread
+    starts with the first submit().
+    """
+    BUSY_RECHECK = 0.5
+
+    def __init__(self, lookup, art_cache, http, rate=12, byte_budget=2 * 1024 * 1024, period=60.0,
+                 busy=None, clock=time.monotonic):
+        super().__init__(name="ArtPrefetch", daemon=True)
+        self.lookup = lookup
+        self.art_cache = art_cache
+        self.http = http
+        self.busy = busy or (lambda: False)
+        self.clock = clock
+        self.period = period
+        self.set_budget(rate, byte_budget)
+        self.pending = OrderedDict()
+        self.active = False
+        self.stopped = False
+        self.cond = threading.Condition()
+        self.stats = {"queued": 0, "skipped": 0, "fetched": 0, "bytes": 0}
+
+    def set_budget(self, rate, byte_budget):
+        self.lookups = TokenBucket(rate, self.period, self.clock)
+        self.bandwidth = TokenBucket(byte_budget, self.period, self.clock)
+
+    def submit(self, items, replace=True):
+        """ Queues (cache_key, *lookup args) tuples; replace drops whatever was queued before. """
+        with self.cond:
+            if replace:
+                self.pending.clear()
+            for item in items:
+                if item[0] not in self.pending and not self.art_cache.contains(item[0]):
+                    self.pending[item[0]] = item
+                    self.stats["queued"] += 1
+            self.cond.notify()
+        if not self.is_alive() and not self.stopped:
+            self.start()
+
+    def next_delay(self):
+        """ Seconds until the next lookup may run; None while there is nothing to do. """
+        if not self.pending:
+            return None
+        if self.busy():
+            return self.BUSY_RECHECK
+        return max(self.lookups.wait_time(), self.bandwidth.wait_time())
+
+    def run(self):
+        while True:
+            with self.cond:
+                self.active = False
+                self.cond.notify_all()
+                delay = self.next_delay()
+                while not self.stopped and delay != 0:
+                    self.cond.wait(delay)
+                    delay = self.next_delay()
+                if self.stopped:
+                    return
+                _, item = self.pending.popitem(last=False)
+                self.active = True
+            if self.art_cache.contains(item[0]):
+                # The foreground fetch got there first
+                self.stats["skipped"] += 1
+                continue
+            self.lookups.try_take()
+            before = self.http.bytes_read
+            self.lookup(*item)
+            used = max(0, self.http.bytes_read - before)
+            self.bandwidth.spend(used)
+            self.stats["fetched"] += 1
+            self.stats["bytes"] += used
+
+    def wait_idle(self, timeout=None):
+        """ Blocks until the queue is drained; returns False if the timeout expired first. """
+        with self.cond:
+            return self.cond.wait_for(lambda: not self.pending and not self.active, timeout)
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.pending.clear()
+            self.cond.notify_all()
+
+# --- CONNECTION SUPERVISOR ---
+class Endpoint:
+    """ Connection state machine for one external endpoint (MediaMonkey or Discord).
+
+    A first failure while connected only marks the endpoint degraded and the
+    next operation retries on the same connection. Further failures drop
+    to backoff, where reconnects wait a jittered exponential delay, and
+    after dead_after failed attempts to dead, where a cheap liveness probe
+    runs about once a minute until the endpoint comes back.
+    """
+    CONNECTED = "connected"
+    DEGRADED = "degraded"
+    BACKOFF = "backoff"
+    DEAD = "dead"
+
+    def __init__(self, name, base_delay=1.0, max_delay=60.0, degrade_limit=2, dead_after=6,
+                 on_change=None, clock=time.monotonic):
+        self.name = name
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.degrade_limit = degrade_limit
+        self.dead_after = dead_after
+        self.on_change = on_change
+        self.clock = clock
+        self.state = self.BACKOFF
+        self.failures = 0
+        self.attempts = 0
+        self.next_attempt = clock()
+        self.stats = {"connects": 0, "failures": 0}
+
+    @property
+    def connected(self):
+        return self.state in (self.CONNECTED, self.DEGRADED)
+
+    def ready(self):
+        """ True when a reconnect attempt is due. """
+        return self.clock() >= self.next_attempt
+
+    def delay(self):
+        return max(0.0, self.next_attempt - self.clock())
+
+    def succeeded(self):
+        """ Records a working operation; returns True if it re-established the connection. """
+        recovered = not self.connected
+        self.failures = 0
+        self.attempts = 0
+        if recovered:
+            self.stats["connects"] += 1
+        self.set_state(self.CONNECTED)
+        return recovered
+
+    def failed(self):
+        self.failures += 1
+        self.stats["failures"] += 1
+        if self.connected and self.failures < self.degrade_limit:
+            self.set_state(self.DEGRADED)
+            return
+        self.attempts += 1
+        delay = min(self.max_delay, self.base_delay * 2 ** (self.attempts - 1))
+        # Jitter keeps restarts of several clients from probing in lockstep
+        self.next_attempt = self.clock() + random.uniform(delay / 2, delay)
+        self.set_state(self.DEAD if self.attempts >= self.dead_after else self.BACKOFF)
+
+    def set_state(self, state):
+        if state == self.state:
+            return
+        old, self.state = self.state, state
+        if self.on_change:
+            self.on_change(self, old)
+
+def discord_available():
+    """ Cheap liveness probe: True if a Discord IPC pipe or socket answers. """
+    try:
+        return get_ipc_path() is not None
+    except Exception:
+        return False
+
+# --- PLAYER WATCHER ---
+PlayerState = namedtuple("PlayerState", "playing song_id artist title album path duration_ms position_ms")
+IDLE_STATE = PlayerState(False, 0, "", "", "", "", 0, 0)
+
+class PlayerSnapshotReader:
+    """ Reads the whole player state in one pass over cached DISPIDs.
+
+    Each property name is resolved to a DISPID once and afterwards read
+    with a direct IDispatch::Invoke, skipping the name lookup pywin32's
+    late binding repeats on every attribute access. The Player object is
+    fetched once, and song metadata is only re-read when CurrentSong.ID
+    changes. `calls` counts cross-process reads; objects without an
+    IDispatch (the replay fakes) are read with plain getattr.
+    """
+    QUEUE_MEMORY = 500
+
+    def __init__(self, app):
+        self.app = app
+        self.player = None
+        self.dispids = {}
+        self.calls = 0
+        self.song = None
+        self.queue_shape = None
+        self.slots = {}
+        self.queued = {}
+
+    def read(self, obj, interface, name, *args):
+        self.calls += 1
+        target = getattr(obj, "_oleobj_", obj)
+        if not hasattr(target, "Invoke"):
+            value = getattr(obj, name)
+            return value(*args) if args else value
+        dispid = self.dispids.get((interface, name))
+        if dispid is None:
+            dispid = self.dispids[(interface, name)] = target.GetIDsOfNames(name)
+        flags = pythoncom.DISPATCH_PROPERTYGET | (pythoncom.DISPATCH_METHOD if args else 0)
+        return target.Invoke(dispid, 0, flags, True, *args)
+
+    def snapshot(self):
+        if self.player is None:
+            self.player = self.read(self.app, "app", "Player")
+        player = self.player
+        if not self.read(player, "player", "IsPlaying") or self.read(player, "player", "IsPaused"):
+            return IDLE_STATE
+        song = self.read(player, "player", "CurrentSong")
+        if not song:
+            return IDLE_STATE
+        song_id = self.read(song, "song", "ID")
+        # Files outside the library share ID -1, so only positive IDs identify a song
+        if self.song is None or song_id <= 0 or self.song[0] != song_id:
+            self.song = (
+                song_id,
+                self.read(song, "song", "ArtistName"),
+                self.read(song, "song", "Title"),
+                self.read(song, "song", "AlbumName"),
+                self.read(song, "song", "Path"),
+                self.read(song, "song", "SongLength"),
+            )
+        return PlayerState(True, *self.song, self.read(player, "player", "PlaybackTime"))
+
+    def upcoming(self, count):
+        """ (artist, album, path) for up to `count` songs after the current one in Now Playing.
+
+        While the list keeps its length and playback moves forward, slots
+        read last time are reused by index, and a song's fields are read
+        only the first time its ID shows up, so a track change usually
+        costs three queue reads plus the one slot that came into view.
+        """
+        if self.player is None:
+            self.player = self.read(self.app, "app", "Player")
+        songs = self.read(self.player, "player", "CurrentSongList")
+        index = self.read(self.player, "player", "CurrentSongIndex")
+        total = self.read(songs, "list", "Count")
+        if self.queue_shape is None or total != self.queue_shape[0] or index < self.queue_shape[1]:
+            # The list was edited or playback went back, so any slot may hold another song now
+            self.slots = {}
+        self.queue_shape = (total, index)
+        slots = {}
+        for i in range(index + 1, min(total, index + 1 + count)):
+            fields = self.slots.get(i)
+            if fields is None:
+                song = self.read(songs, "list", "Item", i)
+                song_id = self.read(song, "song", "ID")
+                fields = self.queued.get(song_id) if song_id > 0 else None
+                if fields is None:
+                    fields = (
+                        self.read(song, "song", "ArtistName"),
+                        self.read(song, "song", "AlbumName"),
+                        self.read(song, "song", "Path"),
+                    )
+                    if song_id > 0:
+                        if len(self.queued) >= self.QUEUE_MEMORY:
+                            del self.queued[next(iter(self.queued))]
+                        self.queued[song_id] = fields
+            slots[i] = fields
+        self.slots = slots
+        return list(slots.values())
+
+class MediaMonkeySource:
+    """ Player source backed by the SongsDB5.SDBApplication COM object.
+
+    Sources expose probe(), connect(), pump(), take_events(), read_state()
+    and disconnect(), plus an events_enabled flag, so PlayerWatcher can be
+    driven by any object with the same shape. connect() attaches to a
+    running MediaMonkey and never launches one.
+    """
+    PROG_ID = "SongsDB5.SDBApplication"
+
+    def __init__(self):
+        self.mm = None
+        self.reader = None
+        self.events_enabled = False
+        self.event_count = 0
+
+    def connect(self):
+        if self.mm is not None:
+            return True
+        source = self
+
+        class PlayerEvents:
+            def OnPlay(self): source.on_event()
+            def OnPause(self): source.on_event()
+            def OnStop(self): source.on_event()
+            def OnSeek(self): source.on_event()
+            def OnTrackEnd(self): source.on_event()
+            def OnPlaybackEnd(self): source.on_event()
+
+        try:
+            app = win32com.client.GetActiveObject(self.PROG_ID)
+        except Exception:
+            # Not in the running object table; probe() saw the process, so Dispatch attaches to it
+            app = self.PROG_ID
+        try:
+            self.mm = win32com.client.DispatchWithEvents(app, PlayerEvents)
+            self.events_enabled = True
+        except Exception:
+            # No type library / event sink available; fall back to polling
+            self.mm = win32com.client.Dispatch(app)
+            self.events_enabled = False
+        self.event_count = 1
+        return True
+
+    def probe(self):
+        """ Cheap check that MediaMonkey is running, without starting it. """
+        try:
+            win32com.client.GetActiveObject(self.PROG_ID)
+            return True
+        except Exception:
+            pass
+        if psutil is None:
+            # No way to tell; let connect() try as the original bridge did
+            return True
+        for proc in psutil.process_iter(["name"]):
+            if (proc.info["name"] or "").lower().startswith("mediamonkey"):
+                return True
+        return False
+
+    def on_event(self):
+        self.event_count += 1
+
+    def pump(self):
+        if self.events_enabled:
+            pythoncom.PumpWaitingMessages()
+
+    def take_events(self):
+        count, self.event_count = self.event_count, 0
+        return count
+
+    def read_state(self):
+        if self.reader is None:
+            self.reader = PlayerSnapshotReader(self.mm)
+        return self.reader.snapshot()
+
+    def disconnect(self):
+        self.mm = None
+        self.reader = None
+        self.events_enabled = False
+
+    @staticmethod
+    def song_fields(song):
+        return song.ArtistName, song.AlbumName, song.Path
+
+    def upcoming(self, count):
+        """ (artist, album, path) for up to `count` songs after the current one in Now Playing. """
+        if self.mm is None or count <= 0:
+            return []
+        if self.reader is None:
+            self.reader = PlayerSnapshotReader(self.mm)
+        return self.reader.upcoming(count)
+
+    def library_songs(self, playlist=None):
+        """ Yields (artist, album, path) for every song in a playlist, or in the whole library. """
+        if playlist:
+            songs = self.mm.PlaylistByTitle(playlist).Tracks
+            for i in range(songs.Count):
+                yield self.song_fields(songs.Item(i))
+            return
+        songs = self.mm.Database.QuerySongs("")
+        while not songs.EOF:
+            yield self.song_fields(songs.Item)
+            songs.Next()
+
+class AdaptiveScheduler:
+    """ Picks the next poll delay from what the player is doing.
+
+    After a track change or a seek the interval snaps to min_interval, then
+    doubles up to play_interval while the track plays, and grows four-fold
+    per quiet poll up to max_interval while paused or stopped. If the track
+    will end before the next poll, the wakeup moves to just after its
+    predicted end. Intervals are in player seconds; time_scale is player
+    seconds per wall second, which the replay harness raises to play
+    sessions faster than real time.
+    """
+    END_MARGIN = 0.3
+    SEEK_TOLERANCE_MS = 2000
+    IDLE_GROWTH = 4
+
+    def __init__(self, min_interval=1.0, play_interval=5.0, max_interval=30.0, time_scale=1.0, clock=time.monotonic):
+        self.min_interval = min_interval
+        self.play_interval = max(min_interval, play_interval)
+        self.max_interval = max(self.play_interval, max_interval)
+        self.time_scale = time_scale
+        self.clock = clock
+        self.interval = min_interval
+        self.last_poll = None
+        self.started = clock()
+        # Poll gaps that ended in a detected change: each bounds that change's detection latency
+        self.gaps = deque(maxlen=1000)
+        self.stats = {"polls": 0, "changes": 0, "seeks": 0, "end_aligned": 0}
+
+    def retune(self, min_interval, play_interval, max_interval):
+        """ Applies new bounds from a config reload without losing the poll history. """
+        self.min_interval = min_interval
+        self.play_interval = max(min_interval, play_interval)
+        self.max_interval = max(self.play_interval, max_interval)
+        self.interval = min(max(self.interval, self.min_interval), self.max_interval)
+
+    def is_seek(self, prev, state, elapsed):
+        if prev is None or not (prev.playing and state.playing) or prev.song_id != state.song_id:
+            return False
+        expected = prev.position_ms + elapsed * 1000
+        return abs(state.position_ms - expected) > self.SEEK_TOLERANCE_MS
+
+    def next_delay(self, prev, state, changed):
+        """ Records one poll that read `state` and returns the seconds until the next one. """
+        now = self.clock()
+        elapsed = (now - self.last_poll) * self.time_scale if self.last_poll is not None else 0.0
+        self.stats["polls"] += 1
+        if not changed and self.is_seek(prev, state, elapsed):
+            self.stats["seeks"] += 1
+            changed = True
+        if changed:
+            self.stats["changes"] += 1
+            if self.last_poll is not None:
+                self.gaps.append(elapsed)
+            self.interval = self.min_interval
+        elif state.playing:
+            self.interval = min(self.interval * 2, self.play_interval)
+        else:
+            self.interval = min(self.interval * self.IDLE_GROWTH, self.max_interval)
+        self.last_poll = now
+        delay = self.interval
+        if state.playing and state.duration_ms > 0:
+            remaining = max(0, state.duration_ms - state.position_ms) / 1000
+            if remaining + self.END_MARGIN < delay:
+                self.stats["end_aligned"] += 1
+                delay = max(self.min_interval, remaining + self.END_MARGIN)
+        return delay / self.time_scale
+
+    def summary(self):
+        hours = max((self.clock() - self.started) * self.time_scale, 1.0) / 3600
+        text = f"{self.stats['polls'] / hours:.0f} polls/h, {self.stats['end_aligned']} aligned to track end"
+        if self.gaps:
+            ordered = sorted(self.gaps)
+            p50 = ordered[len(ordered) // 2]
+            p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+            text += f", changes detected within p50 {p50:.1f} s / p95 {p95:.1f} s"
+        return text
+
+class PlayerWatcher:
+    """ Turns a player source into on_state callbacks.
+
+    With player events, state is read only after an event arrives, plus a
+    slow safety read, and events are pumped less often while nothing
+    plays. Without them the source is polled on the schedule an
+    AdaptiveScheduler picks. Connection failures are handed to an
+    Endpoint, so a closed MediaMonkey is only probed on its backoff
+    schedule instead of every tick.
+    """
+    EVENT_CHECK_INTERVAL = 0.25
+    EVENT_IDLE_CHECK_INTERVAL = 1.0
+    SAFETY_INTERVAL = 30.0
+
+    def __init__(self, source, on_state, scheduler=None, clock=time.monotonic, endpoint=None, metrics=None):
+        self.source = source
+        self.on_state = on_state
+        self.metrics = metrics or Metrics()
+        self.scheduler = scheduler or AdaptiveScheduler(clock=clock)
+        self.clock = clock
+        self.endpoint = endpoint or Endpoint("MediaMonkey", clock=clock)
+        self.state = None
+        self.next_safety_read = 0.0
+        self.wakeups = 0
+
+    def step(self):
+        """ Runs one watcher iteration and returns the seconds until the next one. """
+        self.wakeups += 1
+        endpoint = self.endpoint
+        if not endpoint.connected:
+            if not endpoint.ready():
+                return endpoint.delay()
+            if not self.source.probe():
+                endpoint.failed()
+                return endpoint.delay()
+        try:
+            self.source.connect()
+            self.source.pump()
+            events = self.source.take_events()
+            now = self.clock()
+            if self.source.events_enabled:
+                if events or now >= self.next_safety_read:
+                    self.refresh()
+                    self.next_safety_read = now + self.SAFETY_INTERVAL
+                # Pumping is local, but a paused player needs no sub-second event latency
+                delay = self.EVENT_CHECK_INTERVAL if self.state and self.state.playing else self.EVENT_IDLE_CHECK_INTERVAL
+            else:
+                prev = self.state
+                changed = self.refresh() or events > 0
+                delay = self.scheduler.next_delay(prev, self.state, changed)
+        except Exception as e:
+            self.metrics.exception("player_read", e)
+            endpoint.failed()
+            if endpoint.connected:
+                return self.scheduler.min_interval / self.scheduler.time_scale
+            self.source.disconnect()
+            self.next_safety_read = 0.0
+            if self.state is not None:
+                self.state = None
+                self.on_state(IDLE_STATE)
+            return endpoint.delay()
+        endpoint.succeeded()
+        return delay
+
+    def refresh(self):
+        """ Reads the source, reports the state and returns True if the track or play state changed. """
+        with self.metrics.span("com_read"):
+            state = self.source.read_state()
+        changed = self.state is None or state._replace(position_ms=0) != self.state._replace(position_ms=0)
+        self.state = state
+        self.on_state(state)
+        return changed
+
+# --- DISCORD PUBLISHER ---
+class PlaybackClock:
+    """ Local model of the current track's timeline, for Discord's start/end timestamps.
+
+    observe() predicts where the track should be from the last anchor and
+    only re-anchors when the reported position is off by more than
+    tolerance seconds (a seek, a resume after a pause, a speed change) or
+    the track changed. Between those the same integer timestamps are
+    returned, so read jitter never makes a payload look new, and the end
+    timestamp lets Discord draw the progress bar on its own.
+    """
+    def __init__(self, tolerance=2.0, time_scale=1.0, clock=time.time):
+        self.tolerance = tolerance
+        self.time_scale = time_scale
+        self.clock = clock
+        self.track = None
+        self.anchor = None
+        self.duration = 0.0
+        self.stats = {"anchors": 0, "drift_corrections": 0}
+
+    def observe(self, track, position_ms, duration_ms):
+        """ Returns (start, end) epoch seconds for the track at position_ms; end is None without a duration. """
+        anchor = self.clock() - position_ms / 1000 / self.time_scale
+        if track != self.track or self.anchor is None:
+            self.stats["anchors"] += 1
+        elif abs(anchor - self.anchor) * self.time_scale > self.tolerance:
+            self.stats["drift_corrections"] += 1
+        else:
+            return self.timestamps()
+        self.track = track
+        self.anchor = anchor
+        self.duration = duration_ms / 1000 / self.time_scale
+        return self.timestamps()
+
+    def timestamps(self):
+        if self.anchor is None:
+            return None, None
+        end = int(self.anchor + self.duration) if self.duration > 0 else None
+        return int(self.anchor), end
+
+    def reset(self):
+        self.track = None
+        self.anchor = None
+
+class TokenBucket:
+    """ Allows `capacity` operations per `period` seconds, refilling continuously. """
+    def __init__(self, capacity=5, period=20.0, clock=time.monotonic):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.clock = clock
+        self.tokens = float(capacity)
+        self.updated = clock()
+
+    def refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self):
+        self.refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait_time(self):
+        self.refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    def spend(self, amount):
+        """ Takes `amount` tokens after the fact; the bucket may go into debt. """
+        self.refill()
+        self.tokens -= amount
+
+# --- PRESENCE PAYLOAD ---
+_BRACKETED = re.compile(r"[\(\[].*?[\)\]]")
+
+@functools.lru_cache(maxsize=1024)
+def clean_string(text):
+    """ Drops bracketed suffixes like "(Remastered)" or "[Deluxe]" before art lookups. """
+    return _BRACKETED.sub("", text).strip()
+
+def fit_text(text, limit=128):
+    """ Clips text to one of Discord's activity field limits; fields also need at least 2 characters. """
+    text = text.strip()
+    if len(text) > limit:
+        text = text[:limit - 1].rstrip() + "\u2026"
+    if not text:
+        return None
+    # Pad a 1-character tag with a zero-width space rather than have Discord reject the update
+    return text if len(text) >= 2 else text + "\u200b"
+
+class PresencePayload(namedtuple(
+        "PresencePayload", "state details large_image large_text small_image small_text start end buttons")):
+    """ Immutable rpc.update() arguments: hashable, and compared field by field without building dicts. """
+    __slots__ = ()
+
+    def update_kwargs(self):
+        kwargs = self._asdict()
+        if self.buttons:
+            kwargs["buttons"] = [{"label": label, "url": url} for label, url in self.buttons]
+        else:
+            kwargs["buttons"] = None
+        return kwargs
+
+class PresenceBuilder:
+    """ Builds PresencePayloads, memoizing the per-track text so a tick only fills in art and timestamps.
+
+    Text fields are clipped to Discord's 128-character limit and button URLs
+    to 512, so an overlong tag can't get the whole update rejected.
+    """
+    FIELD_LIMIT = 128
+    URL_LIMIT = 512
+    YOUTUBE_SEARCH = "https://www.youtube.com/results?search_query="
+
+    def __init__(self, cache_size=256):
+        self.track_fields = functools.lru_cache(maxsize=cache_size)(self.make_track_fields)
+
+    def make_track_fields(self, artist, title, album, show_buttons):
+        buttons = None
+        if show_buttons:
+            query = urllib.parse.quote(f"{artist} - {title}")
+            url = self.YOUTUBE_SEARCH + query
+            if len(url) > self.URL_LIMIT:
+                # Cut the encoded query back to a whole %XX escape
+                cut = url[:self.URL_LIMIT]
+                url = cut[:cut.rfind("%")] if "%" in cut[-2:] else cut
+            buttons = (("Listen on YouTube", url),)
+        return (fit_text(f"by {artist}", self.FIELD_LIMIT), fit_text(title, self.FIELD_LIMIT),
+                fit_text(album, self.FIELD_LIMIT), buttons)
+
+    def build(self, artist, title, album, art_url, start=None, end=None, show_buttons=True, small_text="Playing"):
+        state, details, large_text, buttons = self.track_fields(artist, title, album, show_buttons)
+        return PresencePayload(state, details, art_url, large_text, "play", small_text, start, end, buttons)
+
+    def cache_info(self):
+        return self.track_fields.cache_info()
+
+class PresencePublisher:
+    """ Rate-limited, diff-based front end for a pypresence client.
+
+    publish() takes a PresencePayload (or None to clear the presence).
+    Payloads equal to the last one sent are suppressed, and while the
+    token bucket is empty only the newest payload is kept, so a
+    burst of skips collapses into a single update once a token frees up.
+    Discord's IPC allows roughly 5 activity updates per 20 seconds.
+    While rpc is None (Discord down) payloads are only remembered, and
+    attach() re-sends the newest one to the reconnected client.
+    """
+    NOTHING = object()
+
+    def __init__(self, rpc, capacity=5, period=20.0, clock=time.monotonic, on_failure=None, metrics=None):
+        self.rpc = rpc
+        self.metrics = metrics or Metrics()
+        self.bucket = TokenBucket(capacity, period, clock)
+        self.on_failure = on_failure
+        self.last_sent = self.NOTHING
+        self.pending = self.NOTHING
+        self.latest = self.NOTHING
+        self.first_sent = None
+        self.stats = {"sent": 0, "suppressed": 0, "coalesced": 0, "failed": 0}
+
+    def publish(self, payload):
+        """ Queues a payload and returns the seconds until flush() must run again, or None. """
+        self.latest = payload
+        if self.pending is self.NOTHING and payload == self.last_sent:
+            self.stats["suppressed"] += 1
+            return None
+        if self.pending is not self.NOTHING:
+            self.stats["coalesced"] += 1
+        self.pending = payload
+        return self.flush()
+
+    def flush(self):
+        """ Sends the pending payload if a token is available; returns the retry delay or None. """
+        if self.pending is self.NOTHING or self.rpc is None:
+            return None
+        if self.pending == self.last_sent:
+            self.pending = self.NOTHING
+            self.stats["suppressed"] += 1
+            return None
+        if not self.bucket.try_take():
+            return self.bucket.wait_time()
+        payload, self.pending = self.pending, self.NOTHING
+        try:
+            with self.metrics.span("discord_send"):
+                if payload is None:
+                    self.rpc.clear()
+                else:
+                    self.rpc.update(**payload.update_kwargs())
+            self.last_sent = payload
+            self.stats["sent"] += 1
+            if payload is not None and self.first_sent is None:
+                self.first_sent = time.perf_counter()
+        except Exception as e:
+            # Forget what Discord has, so the next publish goes out even if unchanged
+            self.last_sent = self.NOTHING
+            self.stats["failed"] += 1
+            if self.on_failure:
+                self.on_failure(e)
+        return None
+
+    def retry(self):
+        """ Queues the newest payload again after a failed send on a client that is still usable. """
+        if self.pending is self.NOTHING:
+            self.pending = self.latest
+
+    def attach(self, rpc):
+        """ Swaps in a new client (or None) and queues the newest payload for it. """
+        self.rpc = rpc
+        self.last_sent = self.NOTHING
+        self.pending = self.latest
+        return self.flush()
+
+# --- LISTENING JOURNAL ---
+Listen = namedtuple("Listen", "start listened artist title album art")
+
+class ListeningJournal:
+    """ Append-only listening history: fixed 28-byte records plus a string table.
+
+    listens.bin holds one struct per play (start time, seconds listened and
+    string IDs for artist, title, album and art source); strings.jsonl holds
+    each distinct string once, its line number being its ID. append() only
+    buffers; flush() writes the batch, strings first, so a crash can at
+    worst leave a torn last record, which load() drops. Records are kept
+    in memory as columns, so a time range is a bisect on the start column
+    and a top-N is a Counter over one ID column, which stays fast for
+    years of history (about 1.5 MB per 50,000 plays). The files are read
+    on first use, which is on the worker thread rather than at startup.
+    """
+    RECORD = struct.Struct("<dIIIII")
+    RECORDS_FILE = "listens.bin"
+    STRINGS_FILE = "strings.jsonl"
+    # A play counts towards top lists and stats from this many seconds listened
+    MIN_PLAY = 30
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.records_path = os.path.join(directory, self.RECORDS_FILE)
+        self.strings_path = os.path.join(directory, self.STRINGS_FILE)
+        # Re-entrant: summary() runs top() under the same lock
+        self.lock = threading.RLock()
+        self.strings = []
+        self.string_ids = {}
+        self.new_strings = []
+        self.pending = []
+        self.starts = array("d")
+        self.listened = array("I")
+        self.columns = {name: array("I") for name in ("artist", "title", "album", "art")}
+        self.loaded = False
+
+    def ensure_loaded(self):
+        # Callers hold the lock
+        if not self.loaded:
+            self.loaded = True
+            os.makedirs(self.directory, exist_ok=True)
+            self.load()
+
+    def load(self):
+        try:
+            with open(self.strings_path, "rb") as f:
+                data = f.read()
+        except OSError:
+            data = b""
+        good = 0
+        for line in data.splitlines(keepends=True):
+            try:
+                if not line.endswith(b"\n"):
+                    raise ValueError("torn line")
+                self.intern(json.loads(line))
+            except ValueError:
+                # Cut a torn last line so the next batch starts on a fresh one
+                with open(self.strings_path, "r+b") as f:
+                    f.truncate(good)
+                break
+            good += len(line)
+        self.new_strings = []
+        try:
+            with open(self.records_path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return
+        whole = len(data) - len(data) % self.RECORD.size
+        if whole != len(data):
+            with open(self.records_path, "r+b") as f:
+                f.truncate(whole)
+        rows = list(self.RECORD.iter_unpack(data[:whole]))
+        # Strings are written before the records that use them, so only a damaged tail can point past the table
+        while rows and max(rows[-1][2:]) >= len(self.strings):
+            rows.pop()
+        if not rows:
+            return
+        # Stored starts were already kept in order by add_row()
+        columns = list(zip(*rows))
+        self.starts = array("d", columns[0])
+        self.listened = array("I", columns[1])
+        for name, values in zip(self.columns, columns[2:]):
+            self.columns[name] = array("I", values)
+
+    def intern(self, text):
+        string_id = self.string_ids.get(text)
+        if string_id is None:
+            string_id = self.string_ids[text] = len(self.strings)
+            self.strings.append(text)
+            self.new_strings.append(text)
+        return string_id
+
+    def add_row(self, start, listened, ids):
+        # Keep the start column sorted for bisect, even if the clock stepped back
+        self.starts.append(max(start, self.starts[-1]) if self.starts else start)
+        self.listened.append(listened)
+        for column, string_id in zip(self.columns.values(), ids):
+            column.append(string_id)
+
+    def append(self, start, listened, artist, title, album, art):
+        """ Buffers one play; nothing touches the disk until flush(). """
+        with self.lock:
+            self.ensure_loaded()
+            ids = [self.intern(artist), self.intern(title), self.intern(album), self.intern(art)]
+            listened = int(listened)
+            self.add_row(start, listened, ids)
+            self.pending.append(self.RECORD.pack(self.starts[-1], listened, *ids))
+
+    def flush(self):
+        """ Writes the buffered batch; on OSError it stays buffered (and the files unchanged) for the next try. """
+        with self.lock:
+            if not self.pending:
+                return
+            # String IDs are line numbers, so a string must never be lost or written twice
+            if self.new_strings:
+                self.write_batch(self.strings_path,
+                                 "".join(json.dumps(text) + "\n" for text in self.new_strings).encode("utf-8"))
+                self.new_strings = []
+            self.write_batch(self.records_path, b"".join(self.pending))
+            self.pending = []
+
+    @staticmethod
+    def write_batch(path, data):
+        """ Appends data, cutting the file back to its old length if the write fails part-way. """
+        with open(path, "ab") as f:
+            size = f.tell()
+            try:
+                f.write(data)
+                f.flush()
+            except OSError:
+                f.truncate(size)
+                raise
+
+    def __len__(self):
+        with self.lock:
+            self.ensure_loaded()
+            return len(self.starts)
+
+    def span(self, since=None, until=None):
+        self.ensure_loaded()
+        lo = 0 if since is None else bisect.bisect_left(self.starts, since)
+        hi = len(self.starts) if until is None else bisect.bisect_left(self.starts, until)
+        return lo, hi
+
+    def listens(self, since=None, until=None):
+        """ Plays that started in [since, until), oldest first. """
+        with self.lock:
+            lo, hi = self.span(since, until)
+            text = self.strings
+            cols = self.columns
+            return [
+                Listen(self.starts[i], self.listened[i], text[cols["artist"][i]], text[cols["title"][i]],
+                       text[cols["album"][i]], text[cols["art"][i]])
+                for i in range(lo, hi)
+            ]
+
+    def top(self, field="artist", since=None, until=None, limit=10):
+        """ [(name, plays)] for artist, album or title, counting plays of at least MIN_PLAY seconds. """
+        with self.lock:
+            lo, hi = self.span(since, until)
+            column = self.columns[field]
+            listened = self.listened
+            counts = Counter(column[i] for i in range(lo, hi) if listened[i] >= self.MIN_PLAY)
+            return [(self.strings[string_id], plays) for string_id, plays in counts.most_common(limit)]
+
+    def plays(self, field, name, since=None, until=None):
+        with self.lock:
+            self.ensure_loaded()
+            string_id = self.string_ids.get(name)
+            if string_id is None:
+                return 0
+            lo, hi = self.span(since, until)
+            column = self.columns[field]
+            return sum(1 for i in range(lo, hi) if column[i] == string_id and self.listened[i] >= self.MIN_PLAY)
+
+    def summary(self, days=7, limit=5):
+        """ JSON-ready stats for the last `days` days, for the control socket and metrics. """
+        since = time.time() - days * 86400
+        with self.lock:
+            lo, hi = self.span(since)
+            return {
+                "days": days,
+                "plays": hi - lo,
+                "hours": round(sum(self.listened[lo:hi]) / 3600, 1),
+                "top_artists": self.top("artist", since, limit=limit),
+                "top_albums": self.top("album", since, limit=limit),
+                "total_plays": len(self),
+            }
+
+    def stats_text(self, artist, days=7):
+        """ Short presence line such as "12th play of Artist this week". """
+        plays = self.plays("artist", artist, since=time.time() - days * 86400) + 1
+        suffix = "th" if 10 <= plays % 100 <= 20 else {1: "st", 2: "nd", 3: "rd"}.get(plays % 10, "th")
+        period = "this week" if days == 7 else f"in {days} days"
+        return fit_text(f"{plays}{suffix} play of {artist} {period}")
+
+# --- BRIDGE WORKER ---
+BridgeSnapshot = namedtuple("BridgeSnapshot", "running status status_color title artist art_key art")
+
+class BridgeWorker(threading.Thread):
+    """ Background runtime that owns the COM apartment, the Discord connection and artwork fetches.
+
+    The front end talks to it only through send(). The worker answers with
+    ("log", text) and ("state", BridgeSnapshot) messages on ui_queue, which
+    the window drains with after(), so a hung MediaMonkey or a slow Discord
+    socket never blocks the Tk event loop. MediaMonkey and Discord each get
+    an Endpoint state machine, so either can go away and come back while
+    the bridge keeps running. With decode_art=False (headless)
+    only artwork URLs are resolved and PIL is never imported.
+    source_factory and remote_providers let the replay harness substitute
+    stand-ins for MediaMonkey and the artwork APIs, and time_scale tells the
+    poll scheduler how fast the replayed player's clock runs. Given a
+    config_store, the worker checks config.json for edits every few seconds
+    and applies them without a restart. Given a ListeningJournal, every
+    play is recorded with the time it was actually heard.
+    """
+    CONFIG_CHECK_INTERVAL = 2.0
+    JOURNAL_FLUSH_INTERVAL = 60.0
+    SEND_RETRY_DELAY = 1.0
+    # A track resumed after a pause this long (player seconds) counts as a new play
+    LISTEN_GAP = 1800
+    # Read once at startup; a change only takes effect after a restart
+    RESTART_KEYS = ("auto_connect", "start_minimized", "measure_frame_latency", "control_port", "log_file",
+                    "metrics_file", "metrics_interval", "metrics_port")
+
+    def __init__(self, config, art_cache, decode_art=True, source_factory=None, remote_providers=None,
+                 time_scale=1.0, config_store=None, journal=None):
+        super().__init__(name="BridgeWorker", daemon=True)
+        self.config = config
+        self.config_store = config_store
+        self.journal = journal
+        self.listen = None
+        self.stats_text = None
+        self.art_cache = art_cache
+        self.source_factory = source_factory or MediaMonkeySource
+        self.decode_art = decode_art
+        self.time_scale = time_scale
+        self.playback_clock = PlaybackClock(time_scale=time_scale)
+        self.presence_builder = PresenceBuilder()
+        self.metrics = Metrics(trace=config["metrics_trace"])
+        # Save failures of the shared cache show up with the rest of the pipeline's exceptions
+        art_cache.metrics = self.metrics
+        # Front ends set this to their process start to get a cold-start-to-first-presence figure
+        self.launched = time.perf_counter()
+        self.first_presence = None
+        self.metrics_exporters = []
+        self.commands = queue.Queue()
+        self.ui_queue = queue.Queue()
+        self.snapshot = BridgeSnapshot(
+            False, "DISCONNECTED", "#ED4245", "Ready to Connect", "Open MediaMonkey to begin", None, None
+        )
+        self.rpc = None
+        self.publisher = None
+        self.watcher = None
+        self.is_running = False
+        self.last_track = ""
+        self.last_state = None
+        self.current_art_url = "logo"
+        self.http = HttpClient()
+        matcher = AlbumMatcher()
+        self.art_resolver = ArtResolver(
+            [LocalArtProvider()],
+            remote_providers or [
+                ItunesArtProvider(self.http, matcher=matcher),
+                DeezerArtProvider(self.http, matcher=matcher)
+            ],
+            aliases=AliasIndex(art_cache.directory)
+        )
+        self.art_fetcher = ArtFetcher(self.fetch_album_art, lambda *result: self.send("art", *result))
+        self.prefetcher = ArtPrefetcher(
+            self.prefetch_album_art, art_cache, self.http,
+            rate=config["prefetch_per_minute"], byte_budget=config["prefetch_kb_per_minute"] * 1024,
+            busy=self.art_fetcher.busy
+        )
+        self.metrics.add_source("presence", lambda: dict(self.publisher.stats) if self.publisher else None)
+        self.metrics.add_source("art_cache", self.art_cache.metrics)
+        self.metrics.add_source("art_providers", lambda: {k: dict(v) for k, v in self.art_resolver.stats.items()})
+        self.metrics.add_source("timestamps", lambda: dict(self.playback_clock.stats))
+        self.metrics.add_source("prefetch", lambda: dict(self.prefetcher.stats))
+        self.metrics.add_source("art_matching", self.matching_metrics)
+        self.metrics.add_source("journal", lambda: {"plays": len(journal), "unsaved": len(journal.pending)} if journal else None)
+        self.metrics.add_source("endpoints", self.endpoint_metrics)
+        self.metrics.add_source("player", self.player_metrics)
+        self.discord = None
+        self.next_poll = None
+        self.next_flush = None
+        self.next_discord = None
+        self.next_config_check = time.monotonic() if config_store else None
+        self.next_journal_flush = None
+        self.handlers = {
+            "start": self.start_bridge,
+            "stop": self.stop_bridge,
+            "art": self.apply_album_art,
+        }
+
+    def send(self, command, *args):
+        self.commands.put((command, args))
+
+    def post_log(self, message):
+        self.ui_queue.put(("log", message))
+
+    def post_state(self, **changes):
+        self.snapshot = self.snapshot._replace(**changes)
+        self.ui_queue.put(("state", self.snapshot))
+
+    def run(self):
+        if pythoncom:
+            pythoncom.CoInitialize()
+        if self.config_store:
+            self.report_config_problems()
+        self.start_metrics_export()
+        try:
+            while True:
+                try:
+                    command, args = self.commands.get(timeout=self.next_wakeup())
+                except queue.Empty:
+                    command, args = None, ()
+                if command == "quit":
+                    break
+                if command:
+                    self.handlers[command](*args)
+                self.run_due_tasks()
+        finally:
+            self.stop_bridge()
+            self.close_listen()
+            if self.journal:
+                self.flush_journal()
+            self.prefetcher.stop()
+            self.art_fetcher.shutdown()
+            self.art_resolver.shutdown()
+            self.http.close()
+            for exporter in self.metrics_exporters:
+                exporter.stop()
+            if pythoncom:
+                pythoncom.CoUninitialize()
+
+    def start_metrics_export(self):
+        if self.config["metrics_file"]:
+            exporter = MetricsFileExporter(
+                self.metrics, app_path(self.config["metrics_file"]), self.config["metrics_interval"]
+            )
+            exporter.start()
+            self.metrics_exporters.append(exporter)
+        if self.config["metrics_port"]:
+            try:
+                server = MetricsServer(self.config["metrics_port"], self.metrics)
+            except OSError as e:
+                self.post_log(f"Metrics endpoint unavailable: {e}")
+                return
+            server.start()
+            self.metrics_exporters.append(server)
+
+    def matching_metrics(self):
+        matchers = {id(p.matcher): p.matcher for p in self.art_resolver.remote if getattr(p, "matcher", None)}
+        totals = {}
+        for matcher in matchers.values():
+            for key, value in matcher.stats.items():
+                totals[key] = totals.get(key, 0) + value
+        return dict(totals, aliases=self.art_resolver.aliases.metrics())
+
+    def endpoint_metrics(self):
+        endpoints = [self.discord, self.watcher.endpoint if self.watcher else None]
+        return {e.name: dict(e.stats, state=e.state) for e in endpoints if e is not None}
+
+    def player_metrics(self):
+        watcher = self.watcher
+        if watcher is None:
+            return None
+        reader = getattr(watcher.source, "reader", None)
+        return dict(
+            watcher.scheduler.stats,
+            wakeups=watcher.wakeups,
+            events=watcher.source.events_enabled,
+            com_calls=reader.calls if reader else 0,
+        )
+
+    def next_wakeup(self):
+        due = [t for t in (self.next_poll, self.next_flush, self.next_discord, self.next_config_check,
+                           self.next_journal_flush) if t is not None]
+        if not due:
+            return None
+        return max(0.0, min(due) - time.monotonic())
+
+    def run_due_tasks(self):
+        now = time.monotonic()
+        if self.next_flush is not None and now >= self.next_flush:
+            self.next_flush = None
+            self.schedule_flush(self.publisher.flush())
+        if self.next_discord is not None and now >= self.next_discord:
+            self.next_discord = None
+            self.connect_discord()
+        if self.next_poll is not None and now >= self.next_poll:
+            self.next_poll = time.monotonic() + self.watcher.step()
+        if self.next_journal_flush is not None and now >= self.next_journal_flush:
+            self.flush_journal()
+        if self.next_config_check is not None and now >= self.next_config_check:
+            self.next_config_check = now + self.CONFIG_CHECK_INTERVAL
+            changes = self.config_store.reload()
+            self.report_config_problems()
+            if changes:
+                self.apply_config(changes)
+
+    def report_config_problems(self):
+        for problem in self.config_store.problems:
+            self.post_log(f"Config: {problem}")
+        self.config_store.problems = []
+
+    def apply_config(self, changes):
+        """ Applies settings that changed in config.json; self.config already holds the new values. """
+        self.post_log(f"Config reloaded: {', '.join(sorted(changes))}")
+        config = self.config
+        if self.watcher and changes.keys() & {"update_interval", "poll_interval_min", "poll_interval_max"}:
+            self.watcher.scheduler.retune(
+                config["poll_interval_min"], config["update_interval"], config["poll_interval_max"]
+            )
+        if "art_cache_size" in changes:
+            self.art_cache.max_entries = max(1, int(config["art_cache_size"]))
+        if "art_cache_negative_ttl" in changes:
+            self.art_cache.negative_ttl = config["art_cache_negative_ttl"]
+        if "metrics_trace" in changes:
+            self.metrics.trace = config["metrics_trace"]
+        if changes.keys() & {"prefetch_per_minute", "prefetch_kb_per_minute"}:
+            self.prefetcher.set_budget(config["prefetch_per_minute"], config["prefetch_kb_per_minute"] * 1024)
+        if "client_id" in changes and self.is_running:
+            # Presence belongs to the application it was sent under: reconnect as the new one
+            self.publisher.attach(None)
+            self.close_rpc(clear=True)
+            self.next_discord = None
+            self.connect_discord()
+        elif changes.keys() & {"show_buttons", "presence_stats"}:
+            state = self.last_state
+            self.stats_text = self.journal_stats(state.artist) if state and state.playing else None
+            self.republish()
+        restart = [k for k in self.RESTART_KEYS if k in changes]
+        if restart:
+            self.post_log(f"Restart to apply: {', '.join(restart)}")
+
+    def start_bridge(self):
+        if self.is_running: return
+        self.post_log("Initializing Feeble Presence...")
+        self.publisher = PresencePublisher(None, on_failure=self.on_discord_failure, metrics=self.metrics)
+        self.discord = Endpoint("Discord", on_change=self.on_endpoint_change)
+        if self.watcher is None:
+            self.watcher = PlayerWatcher(
+                self.source_factory(), self.on_player_state,
+                scheduler=AdaptiveScheduler(
+                    self.config["poll_interval_min"], self.config["update_interval"],
+                    self.config["poll_interval_max"], time_scale=self.time_scale
+                ),
+                endpoint=Endpoint("MediaMonkey", on_change=self.on_endpoint_change),
+                metrics=self.metrics
+            )
+        self.is_running = True
+        self.last_track = ""
+        self.post_state(running=True)
+        self.connect_discord()
+        self.next_poll = time.monotonic()
+        self.refresh_status()
+
+    def stop_bridge(self):
+        if not self.is_running: return
+        self.is_running = False
+        self.next_poll = None
+        self.next_flush = None
+        self.next_discord = None
+        stats = self.publisher.stats
+        self.post_log(f"Presence updates: {stats['sent']} sent, {stats['suppressed']} suppressed, {stats['coalesced']} coalesced")
+        clock_stats = self.playback_clock.stats
+        self.post_log(f"Timestamps: {clock_stats['anchors']} tracks anchored, {clock_stats['drift_corrections']} seek/drift corrections")
+        self.post_log(f"Art providers: {self.art_resolver.summary()}")
+        if self.watcher.scheduler.stats["polls"]:
+            self.post_log(f"Player polling: {self.watcher.scheduler.summary()}")
+        self.publisher = None
+        self.post_state(running=False, status="DISCONNECTED", status_color="#ED4245")
+        self.close_rpc(clear=True)
+        self.close_listen()
+        if self.journal:
+            self.flush_journal()
+
+    def connect_discord(self):
+        """ One reconnect attempt; on success the last presence is re-published. """
+        if not discord_available():
+            self.discord.failed()
+            self.next_discord = time.monotonic() + self.discord.delay()
+            return
+        try:
+            rpc = Presence(self.config["client_id"])
+            rpc.connect()
+        except Exception as e:
+            self.metrics.exception("discord_connect", e)
+            if self.discord.attempts == 0:
+                self.post_log(f"Connection Error: {e}")
+            self.discord.failed()
+            self.next_discord = time.monotonic() + self.discord.delay()
+            return
+        self.rpc = rpc
+        self.discord.succeeded()
+        self.schedule_flush(self.publisher.attach(rpc))
+
+    def on_discord_failure(self, error):
+        self.metrics.exception("discord_send", error)
+        self.discord.failed()
+        if self.discord.connected:
+            # Degraded: the update was lost, so send it again shortly on the same connection
+            self.publisher.retry()
+            self.next_flush = time.monotonic() + self.SEND_RETRY_DELAY
+            return
+        self.publisher.attach(None)
+        self.close_rpc()
+        self.next_discord = time.monotonic() + self.discord.delay()
+
+    def close_rpc(self, clear=False):
+        if not self.rpc: return
+        try:
+            if clear:
+                self.rpc.clear()
+            self.rpc.close()
+        except Exception as e:
+            self.metrics.exception("discord_close", e)
+        self.rpc = None
+
+    def on_endpoint_change(self, endpoint, old):
+        if endpoint.connected:
+            if old in (Endpoint.BACKOFF, Endpoint.DEAD):
+                self.post_log(f"{endpoint.name} connected")
+        elif endpoint.state == Endpoint.DEAD:
+            self.post_log(f"{endpoint.name} unreachable, checking every {endpoint.max_delay:.0f} s")
+        elif old != Endpoint.DEAD:
+            self.post_log(f"{endpoint.name} lost, retrying with backoff")
+        self.refresh_status()
+
+    def refresh_status(self):
+        if not self.is_running:
+            return
+        if not self.discord.connected:
+            status = ("WAITING FOR DISCORD", "#FEE75C")
+        elif self.watcher is None or not self.watcher.endpoint.connected:
+            status = ("SEARCHING FOR MM5...", "#FEE75C")
+        elif self.last_state is None or not self.last_state.playing:
+            status = ("IDLE", "#FEE75C")
+        else:
+            status = ("CONNECTED", "#57F287")
+        if status != (self.snapshot.status, self.snapshot.status_color):
+            self.post_state(status=status[0], status_color=status[1])
+
+    def on_player_state(self, state):
+        self.last_state = state
+        self.track_listen(state)
+        if state.playing:
+            track_key = f"{state.artist} - {state.title}"
+            start, end = self.playback_clock.observe(
+                (state.song_id, track_key, state.path), state.position_ms, state.duration_ms
+            )
+            if track_key != self.last_track:
+                self.last_track = track_key
+                self.post_log(f"Now Playing: {track_key}")
+                self.metrics.count("tracks")
+                self.post_state(title=state.title, artist=state.artist)
+                self.stats_text = self.journal_stats(state.artist)
+                self.request_album_art(state.artist, state.album, state.path, track_key)
+                self.prefetch_upcoming()
+            self.update_discord(state.artist, state.title, state.album, start_time=start, end_time=end)
+        else:
+            self.last_track = "PAUSED"
+            self.playback_clock.reset()
+            # A paused track must not keep a running progress bar on Discord
+            if self.publisher:
+                self.schedule_flush(self.publisher.publish(None))
+        self.refresh_status()
+
+    def track_listen(self, state):
+        """ Keeps the open play up to date; a different song (or a long pause) closes it into the journal. """
+        if self.journal is None:
+            return
+        now = time.monotonic()
+        listen = self.listen
+        if listen and listen["resumed"] is not None:
+            listen["played"] += (now - listen["resumed"]) * self.time_scale
+            listen["resumed"] = None
+            listen["paused"] = now
+        if not state.playing:
+            return
+        key = (state.song_id, state.artist, state.title)
+        if listen and listen["key"] == key and (now - listen["paused"]) * self.time_scale < self.LISTEN_GAP:
+            listen["resumed"] = now
+            return
+        self.close_listen()
+        self.listen = {
+            "key": key, "track_key": f"{state.artist} - {state.title}",
+            "artist": state.artist, "title": state.title, "album": state.album,
+            "start": time.time(), "played": 0.0, "resumed": now, "paused": now, "art": "none",
+        }
+
+    def flush_journal(self):
+        """ Writes buffered plays; a failed write keeps them buffered and retries on the next interval. """
+        self.next_journal_flush = None
+        try:
+            self.journal.flush()
+        except OSError as e:
+            self.metrics.exception("journal_write", e)
+            self.next_journal_flush = time.monotonic() + self.JOURNAL_FLUSH_INTERVAL
+
+    def close_listen(self):
+        listen, self.listen = self.listen, None
+        if listen is None:
+            return
+        if listen["resumed"] is not None:
+            listen["played"] += (time.monotonic() - listen["resumed"]) * self.time_scale
+        if listen["played"] < 1:
+            return
+        self.journal.append(listen["start"], listen["played"], listen["artist"], listen["title"],
+                            listen["album"], listen["art"])
+        if self.next_journal_flush is None:
+            self.next_journal_flush = time.monotonic() + self.JOURNAL_FLUSH_INTERVAL
+
+    def journal_stats(self, artist):
+        if self.journal is None or not self.config["presence_stats"]:
+            return None
+        return self.journal.stats_text(artist)
+
+    def request_album_art(self, artist, album, path, track_key):
+        request = self.art_request(artist, album, path)
+        # The first publish for a track uses its cached (e.g. prefetched) cover, or the logo, never the previous album's
+        self.current_art_url = self.art_cache.peek_url(request[0]) or "logo"
+        self.art_fetcher.request(request[0], request, track_key)
+
+    @staticmethod
+    def art_request(artist, album, path):
+        clean_artist = clean_string(artist)
+        clean_album = clean_string(album)
+        return (ArtCache.make_key(clean_artist, clean_album), clean_artist, clean_album, path)
+
+    def prefetch_upcoming(self):
+        """ Queues artwork for the next few songs in Now Playing, so their covers are cached before they start. """
+        depth = self.config["prefetch_depth"]
+        upcoming = getattr(self.watcher.source, "upcoming", None)
+        if depth <= 0 or upcoming is None:
+            return
+        try:
+            songs = upcoming(depth)
+        except Exception as e:
+            self.metrics.exception("prefetch_queue", e)
+            return
+        self.prefetcher.submit([self.art_request(*song) for song in songs if song[1]])
+
+    def prefetch_album_art(self, cache_key, clean_artist, clean_album, path):
+        """ Runs on the ArtPrefetch thread; the result only lands in the cache. """
+        with self.metrics.span("art_prefetch", album=clean_album):
+            self.lookup_album_art(cache_key, clean_artist, clean_album, path)
+
+    def fetch_album_art(self, cache_key, clean_artist, clean_album, path):
+        """ Runs on an ArtFetcher thread and returns (art_url, art_key, thumbnail). """
+        with self.metrics.span("art_lookup", album=clean_album):
+            return self.lookup_album_art(cache_key, clean_artist, clean_album, path)
+
+    def lookup_album_art(self, cache_key, clean_artist, clean_album, path):
+        entry = self.art_cache.get(cache_key)
+        if entry is not None:
+            if not self.decode_art:
+                return entry["url"] or "logo", None, None
+            thumb = self.art_cache.load_thumbnail(cache_key, entry)
+            if thumb is not None:
+                return entry["url"] or "logo", cache_key, thumb
+        try:
+            local = self.art_resolver.resolve_local(clean_artist, clean_album, path) if self.decode_art else None
+            if entry is None:
+                remote = self.art_resolver.resolve_remote(clean_artist, clean_album, path)
+                self.metrics.count("art_remote_hits" if remote else "art_remote_misses")
+                if remote is None:
+                    self.art_cache.put_negative(cache_key)
+                    entry = {"url": None}
+                else:
+                    entry = {"url": remote.url}
+                    if not self.decode_art:
+                        self.art_cache.put(cache_key, remote.url)
+            if not self.decode_art:
+                return entry["url"] or "logo", None, None
+            if entry["url"] is None:
+                # Discord gets the logo, but the window can still show the local cover
+                if local is None:
+                    return "logo", None, None
+                thumb = ArtCache.decode_thumbnail(local.data)
+                self.art_cache.remember(cache_key, thumb)
+                return "logo", cache_key, thumb
+            thumb = ArtCache.decode_thumbnail(local.data if local else self.http.get_bytes(entry["url"]))
+            self.art_cache.put(cache_key, entry["url"], thumb)
+            return entry["url"], cache_key, thumb
+        except Exception as e:
+            self.metrics.exception("art_fetch", e)
+            if entry and entry["url"] and self.is_gone(e):
+                # Otherwise the cache and alias index would hand out the dead URL on every play
+                self.art_cache.drop(cache_key)
+                self.art_resolver.forget(clean_artist, clean_album, entry["url"])
+            return "logo", None, None
+
+    @staticmethod
+    def is_gone(error):
+        """ True for errors that say the URL itself is dead, rather than the network or server being unwell. """
+        response = getattr(error, "response", None)
+        return isinstance(error, requests.HTTPError) and response is not None and response.status_code in (403, 404, 410)
+
+    def apply_album_art(self, track_key, art_url, art_key, pil_img):
+        if track_key != self.last_track:
+            return
+        self.current_art_url = art_url
+        if self.listen and self.listen["track_key"] == track_key:
+            self.listen["art"] = "remote" if art_url != "logo" else "local" if art_key else "none"
+        self.post_state(art_key=art_key, art=pil_img)
+        # Push the new cover now instead of waiting for the next player event
+        self.republish()
+
+    def republish(self):
+        """ Re-sends the current track's presence, e.g. after its artwork or settings changed. """
+        state = self.last_state
+        if self.is_running and state and state.playing:
+            start, end = self.playback_clock.timestamps()
+            self.update_discord(state.artist, state.title, state.album, start_time=start, end_time=end)
+
+    def update_discord(self, artist, title, album, start_time=None, end_time=None):
+        if not self.publisher: return
+        delay = self.publisher.publish(self.presence_builder.build(
+            artist, title, album, self.current_art_url,
+            start=start_time, end=end_time, show_buttons=self.config["show_buttons"],
+            small_text=self.stats_text or "Playing"
+        ))
+        self.schedule_flush(delay)
+
+    def note_first_presence(self):
+        if self.first_presence is not None or not self.publisher or self.publisher.first_sent is None:
+            return
+        self.first_presence = self.publisher.first_sent - self.launched
+        self.metrics.observe("first_presence", self.first_presence)
+        self.post_log(f"First presence {self.first_presence * 1000:.0f} ms after launch")
+
+    def schedule_flush(self, delay):
+        self.note_first_presence()
+        if delay is None or self.next_flush is not None: return
+        self.next_flush = time.monotonic() + delay
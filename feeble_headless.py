@@ -0,0 +1,246 @@
+""" Headless Feeble Presence: the MediaMonkey to Discord bridge without a window or tray icon.
+
+Run it as a script, or embed it as a library:
+
+    from feeble_core import ConfigStore
+    from feeble_headless import HeadlessBridge
+
+    store = ConfigStore()
+    bridge = HeadlessBridge(store.load(), config_store=store)
+    bridge.start()
+    ...
+    bridge.stop()
+
+It logs to a rotating file and is controlled with SIGINT/SIGTERM (SIGBREAK
+on Windows) or with one-line commands on a localhost control socket:
+status, metrics, history, start, stop, quit, and watch (a stream of state
+changes).
+Only one bridge (this or the window) runs per machine; a second launch
+reports the running one, or with --attach follows its state read-only.
+
+--prefetch [PLAYLIST] runs the offline bulk mode instead: it warms the
+artwork cache for a playlist (or the whole library) and exits.
+"""
+import time
+_STARTED = time.perf_counter()
+
+import argparse
+import importlib.util
+import json
+import logging
+import os
+import signal
+import sys
+import threading
+from feeble_core import (
+    app_path, ConfigStore, setup_logging, process_footprint, ArtCache, BridgeWorker, MediaMonkeySource, pythoncom,
+    InstanceLock, StateFeed, ControlServer, ListeningJournal, send_command, watch_instance, snapshot_fields
+)
+
+log = logging.getLogger("feeble")
+
+# --- HEADLESS BRIDGE ---
+class HeadlessBridge:
+    """ Runs BridgeWorker with its output routed to logging instead of a window.
+
+    `directory` holds art_cache/ and journal/ (default: next to the
+    script); other keyword arguments go to BridgeWorker, e.g. the replay
+    harness's source_factory and remote_providers.
+    """
+    def __init__(self, config, control_port=None, config_store=None, directory=None, **worker_options):
+        self.config = config
+        self.control_port = config["control_port"] if control_port is None else control_port
+        place = app_path if directory is None else lambda name: os.path.join(directory, name)
+        self.art_cache = ArtCache(
+            place("art_cache"),
+            max_entries=config["art_cache_size"],
+            negative_ttl=config["art_cache_negative_ttl"]
+        )
+        self.journal = ListeningJournal(place("journal"))
+        self.worker = BridgeWorker(config, self.art_cache, decode_art=False, config_store=config_store,
+                                   journal=self.journal, **worker_options)
+        self.worker.launched = _STARTED
+        self.snapshot = self.worker.snapshot
+        self.feed = StateFeed()
+        # stopping: a signal or quit asked run_forever() to stop; stopped: stop() has finished cleaning up
+        self.stopping = threading.Event()
+        self.stopped = threading.Event()
+        self.stop_lock = threading.Lock()
+        self.control = None
+        self.output_thread = threading.Thread(target=self.drain_output, name="HeadlessOutput", daemon=True)
+
+    def start(self):
+        self.worker.start()
+        self.output_thread.start()
+        if self.control_port:
+            try:
+                self.control = ControlServer(self.control_port, self)
+            except OSError as e:
+                log.warning("Control socket unavailable on port %d: %s", self.control_port, e)
+            else:
+                self.control.start()
+        self.worker.send("start")
+
+    def stop(self):
+        with self.stop_lock:
+            if self.stopped.is_set():
+                return
+            self.stopping.set()
+            if self.control:
+                self.control.stop()
+            self.worker.send("quit")
+            self.worker.join(timeout=5)
+            self.worker.ui_queue.put((None, None))
+            self.art_cache.save()
+            self.stopped.set()
+
+    def request_stop(self):
+        """ Asks run_forever() to stop; safe from signal handlers and control socket threads. """
+        self.stopping.set()
+
+    def wait(self, timeout=None):
+        """ Blocks until stop() has finished; returns False if the timeout expired first. """
+        return self.stopped.wait(timeout)
+
+    def run_forever(self):
+        """ Starts the bridge and blocks until a signal or a quit command stops it. """
+        for name in ("SIGINT", "SIGTERM", "SIGBREAK"):
+            signum = getattr(signal, name, None)
+            if signum is not None:
+                signal.signal(signum, lambda *_: self.request_stop())
+        self.start()
+        log.info("Started in %.0f ms, %s", (time.perf_counter() - _STARTED) * 1000, process_footprint())
+        # Short waits keep the main thread responsive to signals on Windows
+        while not self.stopping.wait(1.0):
+            pass
+        # Cleanup runs here, on the main thread, so the process cannot exit half-way through it
+        self.stop()
+        log.info("Stopped")
+
+    def drain_output(self):
+        while True:
+            kind, value = self.worker.ui_queue.get()
+            if kind is None:
+                return
+            if kind == "log":
+                log.info(value)
+                continue
+            if value.status != self.snapshot.status:
+                log.info("Status: %s", value.status)
+            self.snapshot = value
+            self.feed.publish(snapshot_fields(value))
+
+    def status(self):
+        publisher = self.worker.publisher
+        return dict(snapshot_fields(self.snapshot), presence=dict(publisher.stats) if publisher else None)
+
+    def handle_command(self, command):
+        if command == "status":
+            return self.status()
+        if command == "metrics":
+            return self.worker.metrics.snapshot()
+        if command == "history":
+            return self.journal.summary()
+        if command in ("start", "stop"):
+            self.worker.send(command)
+            return {"ok": True}
+        if command == "quit":
+            # The reply goes out before run_forever() tears anything down
+            self.request_stop()
+            return {"ok": True}
+        return {"error": f"unknown command: {command!r}"}
+
+# --- BULK PREFETCH ---
+def prefetch_library(config, playlist=None):
+    """ Resolves artwork for every album in a playlist or the library, within the configured prefetch budget. """
+    if pythoncom is None:
+        raise SystemExit("Bulk prefetch needs pywin32 and a running MediaMonkey 5.")
+    pythoncom.CoInitialize()
+    source = MediaMonkeySource()
+    if not source.probe():
+        raise SystemExit("MediaMonkey is not running.")
+    source.connect()
+    art_cache = ArtCache(
+        app_path("art_cache"),
+        max_entries=config["art_cache_size"],
+        negative_ttl=config["art_cache_negative_ttl"]
+    )
+    # Decode thumbnails too when PIL is around, so the window never downloads them either
+    worker = BridgeWorker(config, art_cache, decode_art=importlib.util.find_spec("PIL") is not None)
+    albums = {}
+    for artist, album, path in source.library_songs(playlist):
+        if album:
+            request = worker.art_request(artist, album, path)
+            albums.setdefault(request[0], request)
+    if len(albums) > art_cache.max_entries:
+        log.warning("%d albums but art_cache_size is %d; only the first %d are prefetched",
+                    len(albums), art_cache.max_entries, art_cache.max_entries)
+    requests = list(albums.values())[:art_cache.max_entries]
+    log.info("Prefetching artwork for %d albums at up to %s lookups/min", len(requests), config["prefetch_per_minute"])
+    prefetcher = worker.prefetcher
+    prefetcher.submit(requests, replace=False)
+    try:
+        while not prefetcher.wait_idle(30.0):
+            log.info("Prefetch progress: %s", prefetcher.stats)
+    finally:
+        prefetcher.stop()
+        worker.http.close()
+        art_cache.save()
+        pythoncom.CoUninitialize()
+    log.info("Prefetch done: %s", prefetcher.stats)
+
+def attach(port):
+    """ Prints the running instance's state changes as JSON lines until it exits. """
+    try:
+        for state in watch_instance(port):
+            print(json.dumps(state), flush=True)
+    except OSError as e:
+        print(f"No running instance on port {port}: {e}", file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run Feeble Presence without a window or tray icon.")
+    parser.add_argument("--config", help="path to config.json (default: next to this script)")
+    parser.add_argument("--send", metavar="COMMAND", help="send status/metrics/history/start/stop/quit to a running instance and exit")
+    parser.add_argument("--console", action="store_true", help="also log to stderr")
+    parser.add_argument("--attach", action="store_true", help="if a bridge is already running, print its state changes")
+    parser.add_argument("--prefetch", nargs="?", const="", metavar="PLAYLIST",
+                        help="warm the artwork cache for a playlist (or the whole library) and exit")
+    args = parser.parse_args(argv)
+
+    store = ConfigStore(args.config)
+    config = store.load()
+    if args.send:
+        try:
+            print(json.dumps(send_command(config["control_port"], args.send)))
+        except OSError as e:
+            print(f"No running instance on port {config['control_port']}: {e}", file=sys.stderr)
+            return 1
+        except ValueError:
+            print(f"The instance on port {config['control_port']} closed without a valid reply", file=sys.stderr)
+            return 1
+        return 0
+
+    if args.prefetch is not None:
+        setup_logging(app_path(config["log_file"]), console=args.console)
+        prefetch_library(config, args.prefetch or None)
+        return 0
+    lock = InstanceLock()
+    if not lock.acquire():
+        # Two bridges would poll MediaMonkey twice and fight over the one Discord presence
+        if not args.attach:
+            print("Feeble Presence is already running; use --send or --attach to talk to it.", file=sys.stderr)
+            return 1
+        return attach(config["control_port"])
+    setup_logging(app_path(config["log_file"]), console=args.console)
+    try:
+        HeadlessBridge(config, config_store=store).run_forever()
+    finally:
+        lock.release()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,18 +1,24 @@
+import time
+_STARTED = time.perf_counter()
+
 import customtkinter as ctk
 import threading
 import sys
-import urllib.parse
-import requests
-import re
-import time
-import json
 import os
-import io
-import win32com.client
+import json
+import zlib
+import queue
 import ctypes
-from pypresence import Presence
+import logging
+from collections import OrderedDict, deque
 from PIL import Image, ImageDraw
 import pystray 
+from feeble_core import (
+    resource_path, app_path, ConfigStore, setup_logging, process_footprint, ArtCache, BridgeWorker,
+    InstanceLock, StateFeed, ControlServer, ListeningJournal, send_command, snapshot_fields
+)
+
+log = logging.getLogger("feeble")
 
 # --- WINDOWS TASKBAR ICON FIX ---
 try:
@@ -22,39 +28,239 @@ try:
 except Exception:
     pass
 
-# --- CONFIGURATION DEFAULTS ---
-DEFAULT_CONFIG = {
-    "client_id": "1462375131782447321",
-    "update_interval": 5,
-    "show_buttons": True,
-    "minimize_to_tray": True,
-    "auto_connect": True,
-    "start_minimized": True
-}
-
 ctk.set_appearance_mode("Dark")
 ctk.set_default_color_theme("dark-blue")
 
-def resource_path(relative_path):
-    """ Get absolute path to resource, works for dev and for PyInstaller """
-    try:
-        base_path = sys._MEIPASS
-    except Exception:
-        base_path = os.path.abspath(".")
-    return os.path.join(base_path, relative_path)
+# --- TRAY ICON ASSETS ---
+class IconAssets:
+    """ Tray icons pre-rendered per state and size, cached as raw RGBA buffers.
+
+    logo.ico is really a 1333x1333 JPEG; logo_fixed.ico is a multi-size ICO
+    and is preferred. The first launch renders every state at every size
+    from the closest source frame and writes them to one zlib-compressed
+    file; later launches rebuild the images with Image.frombuffer() and
+    never decode a logo. The cache is keyed on the source's size and mtime.
+    """
+    SOURCES = ("logo_fixed.ico", "logo.ico")
+    CACHE_FILE = "tray_icons.bin"
+    MAGIC = b"FPIC1\n"
+    SIZES = (16, 32, 64)
+    TRAY_SIZE = 64
+    # State badge colours match the status indicator in the window
+    STATES = {"idle": None, "playing": (87, 242, 135), "paused": (254, 231, 92), "disconnected": (237, 66, 69)}
+
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+        self.source = next((resource_path(n) for n in self.SOURCES if os.path.exists(resource_path(n))), None)
+        self.images = {}
+
+    @property
+    def window_icon(self):
+        """ First source that is a real ICO file, for iconbitmap(). """
+        for name in self.SOURCES:
+            try:
+                with open(resource_path(name), "rb") as f:
+                    if f.read(4) == b"\x00\x00\x01\x00":
+                        return resource_path(name)
+            except OSError:
+                pass
+        return resource_path("logo.ico")
+
+    def stamp(self):
+        if self.source is None:
+            return "fallback"
+        st = os.stat(self.source)
+        return f"{os.path.basename(self.source)}:{st.st_size}:{int(st.st_mtime)}"
+
+    def load(self):
+        stamp = self.stamp()
+        if not self.read_cache(stamp):
+            self.render()
+            self.write_cache(stamp)
+
+    def get(self, state="idle", size=TRAY_SIZE):
+        return self.images.get((state, size)) or self.images[("idle", size)]
+
+    def read_cache(self, stamp):
+        try:
+            with open(self.cache_path, "rb") as f:
+                data = f.read()
+            if not data.startswith(self.MAGIC):
+                return False
+            header_end = data.index(b"\n", len(self.MAGIC))
+            header = json.loads(data[len(self.MAGIC):header_end])
+            if header["stamp"] != stamp:
+                return False
+            raw = memoryview(zlib.decompress(data[header_end + 1:]))
+            images = {}
+            for state, size, offset in header["entries"]:
+                buffer = raw[offset:offset + size * size * 4]
+                images[(state, size)] = Image.frombuffer("RGBA", (size, size), buffer, "raw", "RGBA", 0, 1)
+        except (OSError, ValueError, KeyError, zlib.error):
+            return False
+        self.images = images
+        return True
+
+    def write_cache(self, stamp):
+        entries, chunks, offset = [], [], 0
+        for (state, size), image in self.images.items():
+            entries.append([state, size, offset])
+            chunks.append(image.tobytes())
+            offset += len(chunks[-1])
+        header = json.dumps({"stamp": stamp, "entries": entries}).encode("utf-8")
+        tmp_path = f"{self.cache_path}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(self.MAGIC + header + b"\n" + zlib.compress(b"".join(chunks)))
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            log.warning("Tray icon cache save failed: %s", e)
+
+    def render(self):
+        for size in self.SIZES:
+            base = self.decode(size)
+            for state, color in self.STATES.items():
+                self.images[(state, size)] = self.badge(base, color)
+
+    def decode(self, size):
+        try:
+            if self.source is None:
+                raise FileNotFoundError
+            with Image.open(self.source) as img:
+                if img.format == "ICO":
+                    sizes = img.ico.sizes()
+                    best = (size, size) if (size, size) in sizes else max(sizes)
+                    frame = img.ico.getimage(best).convert("RGBA")
+                else:
+                    img.draft("RGB", (size, size))
+                    frame = img.convert("RGBA")
+            return frame.resize((size, size), Image.LANCZOS)
+        except (OSError, ValueError) as e:
+            if self.source is not None:
+                log.warning("Tray icon %s unreadable, drawing a placeholder: %s", self.source, e)
+            image = Image.new('RGBA', (64, 64), color=(255, 165, 0, 255))
+            d = ImageDraw.Draw(image)
+            d.rectangle((16, 16, 48, 48), fill=(255, 255, 255, 255))
+            return image.resize((size, size), Image.LANCZOS)
+
+    @staticmethod
+    def badge(base, color):
+        if color is None:
+            return base
+        image = base.copy()
+        size = image.width
+        dot = max(5, size * 3 // 8)
+        ImageDraw.Draw(image).ellipse(
+            (size - dot, size - dot, size - 1, size - 1),
+            fill=color + (255,), outline=(30, 30, 30, 255), width=1 if size >= 32 else 0
+        )
+        return image
+
+# --- UI FRAME LATENCY ---
+class FrameLatencyProbe:
+    """ Measures how late Tk after() callbacks fire, which is the latency a user feels in the window. """
+    def __init__(self, widget, report, interval_ms=16, report_every=60.0):
+        self.widget = widget
+        self.report = report
+        self.interval_ms = interval_ms
+        self.report_every = report_every
+        self.samples = []
+        self.window_start = time.perf_counter()
+        self.expected = None
+
+    def start(self):
+        self.expected = time.perf_counter() + self.interval_ms / 1000
+        self.widget.after(self.interval_ms, self.tick)
+
+    def tick(self):
+        now = time.perf_counter()
+        self.samples.append(max(0.0, now - self.expected) * 1000)
+        if now - self.window_start >= self.report_every:
+            self.report(self.summary())
+            self.samples = []
+            self.window_start = now
+        self.expected = now + self.interval_ms / 1000
+        self.widget.after(self.interval_ms, self.tick)
+
+    def summary(self):
+        if not self.samples:
+            return "UI frame latency: no samples"
+        ordered = sorted(self.samples)
+        p50 = ordered[len(ordered) // 2]
+        p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+        return f"UI frame latency: p50 {p50:.1f} ms, p99 {p99:.1f} ms, max {ordered[-1]:.1f} ms over {len(ordered)} frames"
 
 class FeeblePresenceApp(ctk.CTk):
+    UI_DRAIN_MS = 100
+    ART_IMAGE_CACHE = 16
+    # The full history goes to the rotating log file; only a bounded tail lives in memory and in the widget
+    LOG_MEMORY_LINES = 1000
+    LOG_VIEW_LINES = 200
+    LOG_FLUSH_INTERVAL = 0.5
+    TRAY_STATES = {"CONNECTED": "playing", "IDLE": "paused"}
+
     def __init__(self):
         super().__init__()
 
-        self.config = self.load_config()
+        self.config_store = ConfigStore()
+        self.config = self.config_store.load()
+        self.file_log = setup_logging(app_path(self.config["log_file"]))
         self.title("Feeble Presence")
         self.geometry("500x700") 
         self.resizable(False, False)
+        self.icon_assets = IconAssets(app_path(IconAssets.CACHE_FILE))
+        self.icon_path = self.icon_assets.window_icon
 
-        # --- UPDATED ICON HANDLING ---
-        self.icon_path = resource_path("logo.ico")
+        # State Variables
+        self.tray_icon = None
+        self.tray_state = "idle"
+        self.window_built = False
+        self.snapshot = None
+        self.log_lines = deque(maxlen=self.LOG_MEMORY_LINES)
+        self.log_pending = deque(maxlen=self.LOG_VIEW_LINES)
+        self.log_view_count = 0
+        self.log_flushed = 0.0
+        self.shown_art_key = None
+        self.art_images = OrderedDict()
+        self.art_cache = ArtCache(
+            app_path("art_cache"),
+            max_entries=self.config["art_cache_size"],
+            negative_ttl=self.config["art_cache_negative_ttl"]
+        )
+        self.journal = ListeningJournal(app_path("journal"))
+        self.worker = BridgeWorker(self.config, self.art_cache, config_store=self.config_store, journal=self.journal)
+        self.worker.launched = _STARTED
+        self.worker.start()
+        self.feed = StateFeed()
+        self.control = None
+        if self.config["control_port"]:
+            # Later launches hand over to this instance through the control socket
+            try:
+                self.control = ControlServer(self.config["control_port"], self)
+                self.control.start()
+            except OSError as e:
+                self.log(f"Control socket unavailable: {e}")
+        if self.config.get("auto_connect", False):
+            # The worker connects in the background, so there is no reason to wait for the window
+            self.start_bridge()
+
+        self.protocol("WM_DELETE_WINDOW", self.on_close_attempt)
+
+        if self.config.get("start_minimized", False):
+            # Tray and pipeline first; the window is built the first time "Open" is chosen
+            self.withdraw()
+            threading.Thread(target=self.create_tray_icon, daemon=True).start()
+        else:
+            self.build_window()
         
+        self.after(self.UI_DRAIN_MS, self.drain_ui_queue)
+        if self.config.get("measure_frame_latency", False):
+            FrameLatencyProbe(self, self.log).start()
+
+        self.log(f"Started in {(time.perf_counter() - _STARTED) * 1000:.0f} ms, {process_footprint()}")
+
+    def build_window(self):
+        # --- UPDATED ICON HANDLING ---
         if os.path.exists(self.icon_path):
             try:
                 # Set initial icon
@@ -66,25 +272,6 @@ class FeeblePresenceApp(ctk.CTk):
             except Exception as e:
                 print(f"Icon Error: {e}")
 
-        # Tray Image Preparation
-        try:
-            if os.path.exists(self.icon_path):
-                self.tray_image = Image.open(self.icon_path)
-            else:
-                raise FileNotFoundError
-        except:
-            self.tray_image = Image.new('RGB', (64, 64), color=(255, 165, 0))
-            d = ImageDraw.Draw(self.tray_image)
-            d.rectangle((16, 16, 48, 48), fill=(255, 255, 255))
-
-        # State Variables
-        self.rpc = None
-        self.mm = None
-        self.last_track = ""
-        self.is_running = False
-        self.current_art_url = "logo"
-        self.tray_icon = None
-
         self.default_art = ctk.CTkImage(
             light_image=Image.new("RGB", (200, 200), (30, 30, 30)),
             dark_image=Image.new("RGB", (200, 200), (30, 30, 30)),
@@ -142,14 +329,10 @@ class FeeblePresenceApp(ctk.CTk):
         )
         self.log_area.grid(row=3, column=0, padx=20, pady=(5, 20), sticky="nsew")
 
-        self.protocol("WM_DELETE_WINDOW", self.on_close_attempt)
-
-        if self.config.get("start_minimized", False):
-            self.withdraw()
-            threading.Thread(target=self.create_tray_icon, daemon=True).start()
-        
-        if self.config.get("auto_connect", False):
-            self.after(1000, self.start_bridge)
+        self.window_built = True
+        self.render_log_tail()
+        if self.snapshot is not None:
+            self.apply_snapshot(self.snapshot)
 
     def force_icon_update(self):
         """ Re-applies the icon layers to ensure the title bar updates. """
@@ -160,20 +343,12 @@ class FeeblePresenceApp(ctk.CTk):
             except:
                 pass
 
-    def load_config(self):
-        config = DEFAULT_CONFIG.copy()
-        if os.path.exists("config.json"):
-            try:
-                with open("config.json", "r") as f:
-                    config.update(json.load(f))
-            except: pass
-        with open("config.json", "w") as f:
-            json.dump(config, f, indent=4)
-        return config
-
     def create_tray_icon(self):
+        # Loaded on the tray thread, off the startup path
+        if not self.icon_assets.images:
+            self.icon_assets.load()
         menu = pystray.Menu(pystray.MenuItem("Open", self.restore_window), pystray.MenuItem("Quit", self.quit_app))
-        self.tray_icon = pystray.Icon("FeeblePresence", self.tray_image, "Feeble Presence", menu)
+        self.tray_icon = pystray.Icon("FeeblePresence", self.icon_assets.get(self.tray_state), "Feeble Presence", menu)
         self.tray_icon.run()
 
     def on_close_attempt(self):
@@ -187,111 +362,162 @@ class FeeblePresenceApp(ctk.CTk):
     def restore_window(self, icon, item):
         self.tray_icon.stop()
         self.tray_icon = None
-        self.after(100, self.deiconify)
-        self.after(200, self.force_icon_update)
+        self.after(100, self.show_window)
+
+    def show_window(self):
+        if not self.window_built:
+            self.build_window()
+        else:
+            self.render_log_tail()
+        self.deiconify()
+        self.after(100, self.force_icon_update)
+
+    def bring_to_front(self):
+        """ A second launch asked for the window. """
+        if self.tray_icon:
+            self.tray_icon.stop()
+            self.tray_icon = None
+        self.show_window()
+        self.lift()
+        self.focus_force()
+
+    def handle_command(self, command):
+        """ Control socket commands; runs on a socket thread, so UI work goes through ui_queue. """
+        if command == "status":
+            publisher = self.worker.publisher
+            return dict(snapshot_fields(self.worker.snapshot), presence=dict(publisher.stats) if publisher else None)
+        if command == "metrics":
+            return self.worker.metrics.snapshot()
+        if command == "history":
+            return self.journal.summary()
+        if command in ("start", "stop"):
+            self.worker.send(command)
+            return {"ok": True}
+        if command in ("show", "quit"):
+            self.worker.ui_queue.put((command, None))
+            return {"ok": True}
+        return {"error": f"unknown command: {command!r}"}
 
     def quit_app(self, icon=None, item=None):
         if self.tray_icon: self.tray_icon.stop()
-        self.is_running = False
+        if self.control: self.control.stop()
+        self.worker.send("quit")
+        self.worker.join(timeout=2)
+        self.art_cache.save()
         self.quit()
         sys.exit()
 
     def log(self, message):
-        self.log_area.insert("end", f">> {message}\n")
+        """ Buffers a line; flush_log() moves buffered lines into the widget in batches. """
+        line = f">> {message}"
+        self.log_lines.append(line)
+        self.log_pending.append(line)
+        self.file_log.info(message)
+
+    def flush_log(self):
+        if not self.window_built or not self.log_pending or self.state() == "withdrawn":
+            return
+        now = time.monotonic()
+        if now - self.log_flushed < self.LOG_FLUSH_INTERVAL:
+            return
+        self.log_flushed = now
+        lines = list(self.log_pending)
+        self.log_pending.clear()
+        self.log_area.insert("end", "\n".join(lines) + "\n")
+        self.log_view_count += len(lines)
+        excess = self.log_view_count - self.LOG_VIEW_LINES
+        if excess > 0:
+            self.log_area.delete("1.0", f"{excess + 1}.0")
+            self.log_view_count -= excess
+        self.log_area.see("end")
+
+    def render_log_tail(self):
+        """ Redraws the widget from the ring buffer, after the window was hidden in the tray. """
+        tail = list(self.log_lines)[-self.LOG_VIEW_LINES:]
+        self.log_pending.clear()
+        self.log_area.delete("1.0", "end")
+        if tail:
+            self.log_area.insert("end", "\n".join(tail) + "\n")
+        self.log_view_count = len(tail)
         self.log_area.see("end")
 
     def set_status(self, status, color):
         self.status_indicator.configure(text=f"● {status}", text_color=color)
 
-    def start_bridge(self):
-        if self.is_running: return
-        self.log("Initializing Feeble Presence...")
+    def drain_ui_queue(self):
+        state = None
         try:
-            self.rpc = Presence(self.config["client_id"])
-            self.rpc.connect()
-            self.is_running = True
+            while True:
+                kind, value = self.worker.ui_queue.get_nowait()
+                if kind == "log":
+                    self.log(value)
+                elif kind == "show":
+                    self.bring_to_front()
+                elif kind == "quit":
+                    self.quit_app()
+                else:
+                    state = value
+        except queue.Empty:
+            pass
+        if state is not None:
+            self.apply_snapshot(state)
+        self.flush_log()
+        self.after(self.UI_DRAIN_MS, self.drain_ui_queue)
+
+    def apply_snapshot(self, snap):
+        self.snapshot = snap
+        self.feed.publish(snapshot_fields(snap))
+        self.set_tray_state(self.TRAY_STATES.get(snap.status, "disconnected") if snap.running else "idle")
+        if not self.window_built:
+            return
+        self.set_status(snap.status, snap.status_color)
+        self.title_label.configure(text=snap.title)
+        self.artist_label.configure(text=snap.artist)
+        if snap.running:
             self.start_btn.configure(state="disabled", fg_color="#2b2d31")
             self.stop_btn.configure(state="normal", fg_color="#ED4245")
-            self.set_status("CONNECTED", "#57F287")
-            self.poll_mediamonkey() 
-        except Exception as e:
-            self.log(f"Connection Error: {e}")
-            self.set_status("ERROR", "#ED4245")
+        else:
+            self.start_btn.configure(state="normal", fg_color="#5865F2")
+            self.stop_btn.configure(state="disabled", fg_color="#2b2d31")
+        if snap.art_key != self.shown_art_key:
+            self.shown_art_key = snap.art_key
+            self.art_label.configure(image=self.art_image(snap.art_key, snap.art))
+
+    def set_tray_state(self, state):
+        if state == self.tray_state:
+            return
+        self.tray_state = state
+        tray_icon = self.tray_icon
+        if tray_icon is not None and self.icon_assets.images:
+            # Swapping a pre-rendered image; nothing is decoded
+            tray_icon.icon = self.icon_assets.get(state)
+
+    def art_image(self, art_key, pil_img):
+        """ Returns the CTkImage for an album, reusing the one built the last time it played. """
+        if art_key is None or pil_img is None:
+            return self.default_art
+        image = self.art_images.pop(art_key, None)
+        if image is None:
+            image = ctk.CTkImage(light_image=pil_img, dark_image=pil_img, size=(200, 200))
+        self.art_images[art_key] = image
+        while len(self.art_images) > self.ART_IMAGE_CACHE:
+            self.art_images.popitem(last=False)
+        return image
+
+    def start_bridge(self):
+        self.worker.send("start")
 
     def stop_bridge(self):
-        self.is_running = False
-        self.start_btn.configure(state="normal", fg_color="#5865F2")
-        self.stop_btn.configure(state="disabled", fg_color="#2b2d31")
-        self.set_status("DISCONNECTED", "#ED4245")
-        if self.rpc:
-            try: self.rpc.clear()
-            except: pass
-
-    def clean_string(self, text):
-        return re.sub(r"[\(\[].*?[\)\]]", "", text).strip()
-
-    def fetch_album_art(self, artist, album):
-        try:
-            clean_artist = self.clean_string(artist)
-            clean_album = self.clean_string(album)
-            query = urllib.parse.quote(f"{clean_artist} {clean_album}")
-            url = f"https://itunes.apple.com/search?term={query}&media=music&entity=album&limit=1"
-            response = requests.get(url, timeout=2)
-            data = response.json()
-            if data['resultCount'] > 0:
-                art_url = data['results'][0]['artworkUrl100'].replace("100x100", "512x512")
-                self.current_art_url = art_url
-                img_data = requests.get(art_url).content
-                pil_img = Image.open(io.BytesIO(img_data))
-                ctk_img = ctk.CTkImage(light_image=pil_img, dark_image=pil_img, size=(200, 200))
-                self.after(0, lambda: self.art_label.configure(image=ctk_img))
-            else:
-                self.current_art_url = "logo"
-                self.after(0, lambda: self.art_label.configure(image=self.default_art))
-        except:
-            self.current_art_url = "logo"
-            self.after(0, lambda: self.art_label.configure(image=self.default_art))
-
-    def update_discord(self, artist, title, album, start_time=None):
-        if not self.rpc: return
-        try:
-            btns = None
-            if self.config["show_buttons"]:
-                yt_query = urllib.parse.quote(f"{artist} - {title}")
-                btns = [{"label": "Listen on YouTube", "url": f"https://www.youtube.com/results?search_query={yt_query}"}]
-            self.rpc.update(
-                state=f"by {artist}", details=f"{title}",
-                large_image=self.current_art_url, large_text=album,
-                small_image="play", small_text="Playing",
-                start=start_time, buttons=btns
-            )
-        except: pass
-
-    def poll_mediamonkey(self):
-        if not self.is_running: return
-        try:
-            if self.mm is None:
-                self.mm = win32com.client.Dispatch("SongsDB5.SDBApplication")
-            if self.mm and self.mm.Player.IsPlaying:
-                song = self.mm.Player.CurrentSong
-                if song:
-                    current_pos_sec = self.mm.Player.PlaybackTime / 1000
-                    start_timestamp = int(time.time() - current_pos_sec)
-                    track_key = f"{song.ArtistName} - {song.Title}"
-                    if track_key != self.last_track:
-                        self.last_track = track_key
-                        self.log(f"Now Playing: {track_key}")
-                        self.title_label.configure(text=song.Title)
-                        self.artist_label.configure(text=song.ArtistName)
-                        threading.Thread(target=self.fetch_album_art, args=(song.ArtistName, song.AlbumName), daemon=True).start()
-                    self.update_discord(song.ArtistName, song.Title, song.AlbumName, start_time=start_timestamp)
-            else:
-                self.last_track = "PAUSED"
-                self.set_status("IDLE", "#FEE75C")
-        except:
-            self.mm = None
-        self.after(self.config["update_interval"] * 1000, self.poll_mediamonkey)
+        self.worker.send("stop")
 
 if __name__ == "__main__":
+    instance = InstanceLock()
+    if not instance.acquire():
+        # A bridge (window or headless) is already running: bring it forward rather than start a second poller
+        try:
+            send_command(ConfigStore().load()["control_port"], "show")
+        except (OSError, ValueError):
+            pass
+        sys.exit(0)
     app = FeeblePresenceApp()
     app.mainloop()
\ No newline at end of file
@@ -0,0 +1,1343 @@
+""" Replay harness and benchmark suite for the bridge pipeline.
+
+Recorded or synthetic MediaMonkey sessions are replayed through the real
+BridgeWorker on plain Linux, against local stand-ins:
+
+* FakeSDBApplication - the Player / CurrentSong / Now Playing surface of SongsDB5.SDBApplication
+* FakeDiscordIPC     - a Unix socket speaking Discord's IPC framing, driven by the real pypresence client
+* FakeItunesServer   - an HTTP server answering iTunes search and artwork requests
+
+Session files are JSON lines ordered by "t", the seconds since the session
+started:
+
+    {"t": 0, "type": "play", "track": {"artist": "A", "title": "T", "album": "B", "path": "", "duration_ms": 215000}}
+    {"t": 42.5, "type": "seek", "position_ms": 120000}
+    {"t": 60, "type": "pause"}
+    {"t": 75, "type": "resume"}
+    {"t": 80, "type": "com_error", "duration": 10}
+    {"t": 95, "type": "stop"}
+    {"t": 100, "type": "end"}
+
+"play" may carry "position_ms" to start mid-track. "com_error" makes every
+COM call fail for "duration" seconds, as when MediaMonkey is closed or hung.
+Fault events for soak runs:
+
+    {"t": 300, "type": "discord_down", "duration": 60}      IPC socket drops every client and refuses new ones
+    {"t": 400, "type": "discord_garbage", "count": 2}       the next replies are malformed JSON
+    {"t": 500, "type": "itunes_timeout", "duration": 120}   searches hang past the client's read timeout
+    {"t": 600, "type": "itunes_garbage", "duration": 120}   searches answer with malformed JSON
+
+--soak HOURS generates hours of such a session with faults every few
+minutes and reports resource growth, latency and time to recover from each
+fault kind. Plays during and right after an iTunes fault get albums not
+heard before, and prefetch is off, so the fault meets real lookups.
+
+Usage:
+    python feeble_replay.py session.jsonl
+    python feeble_replay.py --synthetic 40 --speed 20 --idle 30
+    python feeble_replay.py --soak 6 --speed 60
+    python feeble_replay.py --bench-payload
+    python feeble_replay.py --bench-matching
+    python feeble_replay.py --bench-journal
+    python feeble_replay.py --check-http
+    python feeble_replay.py --check-quit
+    python feeble_replay.py --record session.jsonl --duration 3600    (Windows, live MediaMonkey)
+"""
+import argparse
+import http.server
+import io
+import json
+import os
+import random
+import socket
+import struct
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from collections import Counter
+import requests
+from feeble_core import (
+    DEFAULT_CONFIG, ArtCache, BridgeWorker, HttpClient, ResponseTooLarge, ItunesArtProvider,
+    MediaMonkeySource, PlayerWatcher, AdaptiveScheduler, PresenceBuilder, AlbumMatcher, AliasIndex, ArtResult,
+    ListeningJournal, send_command, pythoncom
+)
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# --- SESSIONS ---
+def load_session(path):
+    with open(path, "r", encoding="utf-8") as f:
+        events = [json.loads(line) for line in f if line.strip()]
+    return sorted(events, key=lambda e: e["t"])
+
+def save_session(path, events):
+    with open(path, "w", encoding="utf-8") as f:
+        for event in events:
+            f.write(json.dumps(event) + "\n")
+
+def synthetic_session(tracks=40, albums=8, seed=1):
+    """ Builds an album-heavy session with skips, pauses, seeks and the odd COM outage.
+
+    Every fifth album is named "Rare Sessions ...", which FakeItunesServer
+    never finds, so negative caching gets exercised too.
+    """
+    rng = random.Random(seed)
+    catalog = [
+        (f"Artist {i}", f"Rare Sessions {i}" if i % 5 == 4 else f"Album {i}")
+        for i in range(albums)
+    ]
+    events = []
+    t = 0.0
+    album = 0
+    for n in range(tracks):
+        if n and rng.random() < 0.25:
+            album = rng.randrange(albums)
+        artist, album_name = catalog[album]
+        duration_ms = rng.randint(150, 300) * 1000
+        events.append({"t": round(t, 3), "type": "play", "track": {
+            "artist": artist, "title": f"Track {n}", "album": album_name, "path": "", "duration_ms": duration_ms
+        }})
+        roll = rng.random()
+        listened = duration_ms / 1000
+        if roll < 0.2:
+            listened = rng.uniform(2, 15)
+        elif roll < 0.3:
+            events.append({"t": round(t + listened / 3, 3), "type": "seek", "position_ms": int(duration_ms * 2 / 3)})
+            listened = listened * 2 / 3
+        elif roll < 0.4:
+            pause = rng.uniform(10, 120)
+            events.append({"t": round(t + listened / 2, 3), "type": "pause"})
+            events.append({"t": round(t + listened / 2 + pause, 3), "type": "resume"})
+            listened += pause
+        elif roll < 0.43:
+            events.append({"t": round(t + listened / 2, 3), "type": "com_error", "duration": 20})
+        t += listened
+    events.append({"t": round(t, 3), "type": "stop"})
+    events.append({"t": round(t + 1, 3), "type": "end"})
+    return events
+
+# --- FAKE MEDIAMONKEY ---
+class FakeComError(Exception):
+    """ Stands in for pywintypes.com_error. """
+
+class FakeSong:
+    def __init__(self, app, track, song_id):
+        self._app = app
+        self._track = track
+        self._id = song_id
+
+    def _read(self, value):
+        self._app.com_call()
+        return value
+
+    ID = property(lambda self: self._read(self._id))
+    ArtistName = property(lambda self: self._read(self._track["artist"]))
+    Title = property(lambda self: self._read(self._track["title"]))
+    AlbumName = property(lambda self: self._read(self._track["album"]))
+    Path = property(lambda self: self._read(self._track.get("path", "")))
+    SongLength = property(lambda self: self._read(self._track.get("duration_ms", 0)))
+
+class FakeSongList:
+    """ Now Playing: every track the session will play, in order. """
+    def __init__(self, app):
+        self._app = app
+
+    @property
+    def Count(self):
+        self._app.com_call()
+        return len(self._app.queue)
+
+    def Item(self, index):
+        self._app.com_call()
+        # Same IDs the player gives these songs once they play
+        return FakeSong(self._app, self._app.queue[index], index + 1)
+
+class FakePlayer:
+    def __init__(self, app):
+        self._app = app
+
+    def _read(self, value):
+        self._app.com_call()
+        return value
+
+    IsPlaying = property(lambda self: self._read(self._app.playing))
+    IsPaused = property(lambda self: self._read(self._app.paused))
+    CurrentSong = property(lambda self: self._read(self._app.song))
+    PlaybackTime = property(lambda self: self._read(self._app.position_ms()))
+    CurrentSongList = property(lambda self: self._read(FakeSongList(self._app)))
+    CurrentSongIndex = property(lambda self: self._read(self._app.song_id - 1))
+
+class FakeSDBApplication:
+    """ Timeline-driven stand-in for SongsDB5.SDBApplication.
+
+    Every property read counts as one cross-process COM call in `calls`;
+    `reads` counts player-state snapshots taken by the source.
+    """
+    def __init__(self, clock, queue=()):
+        self.clock = clock
+        self.queue = list(queue)
+        self.calls = 0
+        self.reads = 0
+        self.listeners = []
+        self.song = None
+        self.song_id = 0
+        self.playing = False
+        self.paused = False
+        self.anchor_pos = 0
+        self.anchor_time = 0.0
+        self.outage_until = -1.0
+        self._player = FakePlayer(self)
+
+    @property
+    def Player(self):
+        self.com_call()
+        return self._player
+
+    def com_call(self):
+        self.calls += 1
+        if self.clock() < self.outage_until:
+            raise FakeComError("The RPC server is unavailable.")
+
+    def position_ms(self):
+        if not self.playing:
+            return 0
+        pos = self.anchor_pos
+        if not self.paused:
+            pos += (self.clock() - self.anchor_time) * 1000
+        return int(min(pos, self.song._track.get("duration_ms") or pos))
+
+    def apply(self, event):
+        now = self.clock()
+        kind = event["type"]
+        if kind == "play":
+            self.song_id += 1
+            self.song = FakeSong(self, event["track"], self.song_id)
+            self.playing, self.paused = True, False
+            self.anchor_pos, self.anchor_time = event.get("position_ms", 0), now
+        elif kind == "pause" and self.playing:
+            self.anchor_pos, self.anchor_time = self.position_ms(), now
+            self.paused = True
+        elif kind == "resume" and self.playing:
+            self.anchor_time = now
+            self.paused = False
+        elif kind == "seek" and self.playing:
+            self.anchor_pos, self.anchor_time = event["position_ms"], now
+        elif kind == "stop":
+            self.song = None
+            self.playing = self.paused = False
+        elif kind == "com_error":
+            self.outage_until = now + event.get("duration", 5)
+            return
+        for listener in list(self.listeners):
+            listener()
+
+class FakeMediaMonkeySource(MediaMonkeySource):
+    """ MediaMonkeySource attached to a FakeSDBApplication instead of COM. """
+    def __init__(self, app, events=True):
+        super().__init__()
+        self.app = app
+        self.use_events = events
+        self.lock = threading.Lock()
+
+    def connect(self):
+        if self.mm is None:
+            self.app.com_call()
+            self.mm = self.app
+            self.events_enabled = self.use_events
+            self.event_count = 1
+            if self.use_events:
+                self.app.listeners.append(self.on_event)
+        return True
+
+    def probe(self):
+        # A running-object-table lookup, which never reaches the player itself
+        return self.app.clock() >= self.app.outage_until
+
+    def on_event(self):
+        # Events arrive on the replay thread rather than through a message pump
+        with self.lock:
+            self.event_count += 1
+
+    def take_events(self):
+        with self.lock:
+            return super().take_events()
+
+    def pump(self):
+        pass
+
+    def read_state(self):
+        self.app.reads += 1
+        return super().read_state()
+
+    def disconnect(self):
+        if self.on_event in self.app.listeners:
+            self.app.listeners.remove(self.on_event)
+        super().disconnect()
+
+# --- FAKE DISCORD ---
+class FakeDiscordIPC:
+    """ Minimal Discord IPC server on a Unix socket that records every SET_ACTIVITY. """
+    def __init__(self, path):
+        self.path = path
+        self.activities = []
+        self.connections = 0
+        self.lock = threading.Lock()
+        self.clients = set()
+        self.down_until = 0.0
+        self.garbage = 0
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(path)
+        self.server.listen(8)
+        threading.Thread(target=self.accept_loop, name="FakeDiscordIPC", daemon=True).start()
+
+    def accept_loop(self):
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                return
+            if time.perf_counter() < self.down_until:
+                conn.close()
+                continue
+            threading.Thread(target=self.serve, args=(conn,), daemon=True).start()
+
+    def outage(self, seconds):
+        """ Drops every client and refuses connections for `seconds` (wall clock). """
+        with self.lock:
+            self.down_until = time.perf_counter() + seconds
+            clients = list(self.clients)
+        for conn in clients:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def reply_garbage(self, count):
+        with self.lock:
+            self.garbage += count
+
+    @staticmethod
+    def recv_exact(conn, size):
+        data = b""
+        while len(data) < size:
+            chunk = conn.recv(size - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
+    @staticmethod
+    def send(conn, op, payload):
+        body = json.dumps(payload).encode("utf-8")
+        conn.sendall(struct.pack("<II", op, len(body)) + body)
+
+    def serve(self, conn):
+        with self.lock:
+            self.clients.add(conn)
+        try:
+            self.serve_client(conn)
+        except OSError:
+            pass
+        finally:
+            with self.lock:
+                self.clients.discard(conn)
+            conn.close()
+
+    def serve_client(self, conn):
+        with conn:
+            while True:
+                header = self.recv_exact(conn, 8)
+                if header is None:
+                    return
+                op, length = struct.unpack("<II", header)
+                body = self.recv_exact(conn, length)
+                if body is None:
+                    return
+                payload = json.loads(body)
+                if op == 0:
+                    with self.lock:
+                        self.connections += 1
+                    self.send(conn, 1, {"cmd": "DISPATCH", "evt": "READY", "data": {"v": 1, "user": {"id": "0"}}})
+                elif op == 1:
+                    with self.lock:
+                        garbage = self.garbage > 0
+                        self.garbage -= garbage
+                    if garbage:
+                        body = b'{"cmd": "SET_ACTIVITY", "data": {'
+                        conn.sendall(struct.pack("<II", 1, len(body)) + body)
+                        continue
+                    activity = payload.get("args", {}).get("activity")
+                    with self.lock:
+                        self.activities.append((time.perf_counter(), activity))
+                    self.send(conn, 1, {"cmd": payload.get("cmd"), "data": activity, "evt": None, "nonce": payload.get("nonce")})
+                elif op == 3:
+                    self.send(conn, 4, payload)
+                else:
+                    return
+
+    def close(self):
+        self.server.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+FAULTS = ("com_error", "discord_down", "discord_garbage", "itunes_timeout", "itunes_garbage")
+
+def soak_session(hours, seed=1, fault_every=600):
+    """ `hours` of album-heavy listening with a random fault about every `fault_every` session seconds. """
+    events = synthetic_session(tracks=max(4, int(hours * 16)), albums=max(8, int(hours * 6)), seed=seed)
+    rng = random.Random(seed + 1)
+    # Faults stay clear of the trailing stop/end events
+    last = events[-2]["t"]
+    t = rng.uniform(fault_every / 2, fault_every)
+    faults = []
+    while t < last - 60:
+        kind = rng.choice(FAULTS)
+        if kind == "discord_garbage":
+            faults.append({"t": round(t, 3), "type": kind, "count": rng.randint(1, 3)})
+        else:
+            duration = rng.uniform(20, 90) if kind in ("com_error", "discord_down") else rng.uniform(60, 300)
+            faults.append({"t": round(t, 3), "type": kind, "duration": round(duration, 1)})
+        t += rng.uniform(fault_every / 2, fault_every * 1.5)
+    # The art cache and aliases answer repeat albums locally, so an iTunes fault is only felt by albums
+    # never seen before: give one to the first play during the fault and one to the first after it
+    plays = [e for e in events if e["type"] == "play"]
+    fresh = 0
+    for fault in faults:
+        if not fault["type"].startswith("itunes"):
+            continue
+        for moment in (fault["t"], fault["t"] + fault["duration"]):
+            play = next((e for e in plays if e["t"] >= moment), None)
+            if play is not None:
+                fresh += 1
+                play["track"] = dict(play["track"], album=f"Fresh Pressings {fresh}")
+    return sorted(events[:-2] + faults, key=lambda e: e["t"]) + events[-2:]
+
+# --- FAKE ITUNES ---
+class FakeItunesServer(http.server.ThreadingHTTPServer):
+    """ Answers /search like the iTunes Search API and serves a 512x512 JPEG for every cover.
+
+    Albums in `catalog` are found, each ranked behind a karaoke cover
+    version the way real search results often are; anything else is a miss.
+    /http/... serves the flaky, oversized, stalled and slow responses --check-http
+    points HttpClient at.
+    """
+    daemon_threads = True
+
+    def __init__(self, catalog=()):
+        super().__init__(("127.0.0.1", 0), FakeItunesHandler)
+        self.base_url = f"http://127.0.0.1:{self.server_address[1]}"
+        self.catalog = {f"{artist} {album}": (artist, album) for artist, album in catalog}
+        self.stall_until = 0.0
+        self.garbage_until = 0.0
+        # perf_counter of every search, and of every one answered normally, for recovery times
+        self.requested = []
+        self.answered = []
+        self.counts = {"search": 0, "art": 0, "connections": 0}
+        # Requests per /http/flaky key, for HttpClient's retry check
+        self.flaky = Counter()
+        self.lock = threading.Lock()
+        from PIL import Image
+        buf = io.BytesIO()
+        Image.new("RGB", (512, 512), (90, 40, 160)).save(buf, "JPEG", quality=85)
+        self.jpeg = buf.getvalue()
+        threading.Thread(target=self.serve_forever, name="FakeItunes", daemon=True).start()
+
+    def count(self, key):
+        with self.lock:
+            self.counts[key] += 1
+
+    def handle_error(self, request, client_address):
+        # Clients hanging up mid-response is expected in the size, deadline and fault checks
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+class FakeItunesHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.count("connections")
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, body, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path == "/search":
+            now = time.perf_counter()
+            self.server.requested.append(now)
+            if now < self.server.stall_until:
+                # Hold the request past the client's read timeout
+                time.sleep(self.server.stall_until - now)
+                self.send_error(503)
+                return
+            if now < self.server.garbage_until:
+                self.reply(b'{"resultCount": 1, "results": [{"collectionName": ', "application/json")
+                return
+            self.server.count("search")
+            self.server.answered.append(time.perf_counter())
+            term = urllib.parse.parse_qs(url.query).get("term", [""])[0]
+            results = []
+            if term in self.server.catalog:
+                artist, album = self.server.catalog[term]
+                results = [
+                    self.album("Sing-Along Stars", f"{album} (Karaoke Version)", 2),
+                    self.album(artist, album, 1),
+                ]
+            self.reply(json.dumps({"resultCount": len(results), "results": results}).encode("utf-8"), "application/json")
+        elif url.path.startswith("/art/"):
+            self.server.count("art")
+            self.reply(self.server.jpeg, "image/jpeg")
+        elif url.path.startswith("/http/"):
+            try:
+                self.misbehave(url.path[len("/http/"):], {k: v[0] for k, v in urllib.parse.parse_qs(url.query).items()})
+            except OSError:
+                # The client hung up on purpose (too large, too slow)
+                self.close_connection = True
+        else:
+            self.send_error(404)
+
+    def misbehave(self, kind, query):
+        if kind == "flaky":
+            # Answers `status` for the first `fail` requests with this key, then 200
+            with self.server.lock:
+                self.server.flaky[query["key"]] += 1
+                attempt = self.server.flaky[query["key"]]
+            if attempt <= int(query["fail"]):
+                body = b"try again"
+                self.send_response(int(query["status"]))
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            else:
+                self.reply(b"ok", "text/plain")
+        elif kind == "large":
+            # Announces its size up front, so the client can refuse it before reading
+            size = int(query["size"])
+            self.send_response(200)
+            self.send_header("Content-Type", "image/jpeg")
+            self.send_header("Content-Length", str(size))
+            self.end_headers()
+            self.wfile.write(bytes(size))
+        elif kind == "stall":
+            # Sits on the request before sending any headers, like an overloaded upstream
+            time.sleep(float(query["seconds"]))
+            self.reply(b"late", "text/plain")
+        elif kind in ("stream", "slow"):
+            # Chunked without a Content-Length; "slow" trickles chunks inside the read timeout but past any deadline
+            chunks, size, pause = (int(query["size"]) // 8192 + 1, 8192, 0.0) if kind == "stream" else \
+                (int(float(query["seconds"]) / 0.1), 64, 0.1)
+            self.send_response(200)
+            self.send_header("Content-Type", "image/jpeg")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for _ in range(chunks):
+                self.wfile.write(b"%x\r\n%s\r\n" % (size, bytes(size)))
+                self.wfile.flush()
+                time.sleep(pause)
+            self.wfile.write(b"0\r\n\r\n")
+        else:
+            self.send_error(404)
+
+    def album(self, artist, album, collection_id):
+        art = urllib.parse.quote(f"{artist} {album}")
+        return {
+            "artistName": artist, "collectionName": album, "collectionId": collection_id,
+            "artworkUrl100": f"{self.server.base_url}/art/{art}/100x100bb.jpg"
+        }
+
+# --- HARNESS ---
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+class ReplayHarness:
+    """ Replays a session through a real BridgeWorker wired to the fakes and collects measurements.
+
+    Session time runs `speed` times faster than wall time; the worker itself
+    runs in real time, so latencies are real wall-clock figures.
+    """
+    def __init__(self, events, speed=1.0, use_events=True, workdir=None, config=None, http=None):
+        self.events = events
+        self.speed = speed
+        self.workdir = workdir or tempfile.mkdtemp(prefix="feeble-replay-")
+        # pypresence looks for discord-ipc-* under XDG_RUNTIME_DIR on Linux
+        os.environ["XDG_RUNTIME_DIR"] = self.workdir
+        self.ipc = FakeDiscordIPC(os.path.join(self.workdir, "discord-ipc-0"))
+        # Every album in the session except the "Rare Sessions" ones, which exercise negative caching
+        self.itunes = FakeItunesServer({
+            (e["track"]["artist"], e["track"]["album"]) for e in events
+            if e["type"] == "play" and "Rare Sessions" not in e["track"]["album"]
+        })
+        self.started = None
+        self.app = FakeSDBApplication(self.session_time, [e["track"] for e in events if e["type"] == "play"])
+        self.config = dict(DEFAULT_CONFIG, **(config or {}))
+        self.art_cache = ArtCache(os.path.join(self.workdir, "art_cache"))
+        self.journal = ListeningJournal(os.path.join(self.workdir, "journal"))
+        self.worker = BridgeWorker(
+            self.config, self.art_cache,
+            source_factory=lambda: FakeMediaMonkeySource(self.app, use_events),
+            remote_providers=[ItunesArtProvider(http or HttpClient(), base_url=self.itunes.base_url)],
+            time_scale=speed, journal=self.journal
+        )
+        self.track_changes = []
+        self.rss_samples = []
+        # (wall seconds into the replay, rss, threads, handles) every few seconds
+        self.resource_samples = []
+        self.faults = []
+        self.sampling = threading.Event()
+
+    def session_time(self):
+        if self.started is None:
+            return 0.0
+        return (time.perf_counter() - self.started) * self.speed
+
+    def sample_memory(self):
+        process = psutil.Process() if psutil else None
+        ticks = 0
+        while not self.sampling.wait(0.5):
+            if process:
+                self.rss_samples.append(process.memory_info().rss)
+            ticks += 1
+            if ticks % 10 == 0:
+                usage = self.footprint()
+                self.resource_samples.append((time.perf_counter() - self.started, usage["rss"], usage["threads"], usage["fds"]))
+
+    def inject(self, event):
+        """ Starts a fault; watch_recovery() times how long the bridge takes to get past it. """
+        kind = event["type"]
+        now = time.perf_counter()
+        wall = event.get("duration", 0) / self.speed
+        if kind == "com_error":
+            self.app.apply(event)
+        elif kind == "discord_down":
+            self.ipc.outage(wall)
+        elif kind == "discord_garbage":
+            self.ipc.reply_garbage(event.get("count", 1))
+        elif kind == "itunes_timeout":
+            self.itunes.stall_until = now + wall
+        elif kind == "itunes_garbage":
+            self.itunes.garbage_until = now + wall
+        # Garbage replies end when the bridge has read them all, which watch_recovery() notices
+        ends = None if kind == "discord_garbage" else now + wall
+        self.faults.append({"kind": kind, "ends": ends, "baseline": None, "recovered": None})
+
+    def recovered(self, fault):
+        """ Whether the bridge is back to normal after `fault`, compared with its baseline at the fault's end. """
+        kind = fault["kind"]
+        if kind == "com_error":
+            watcher = self.worker.watcher
+            return self.app.reads > fault["baseline"] and watcher.endpoint.connected
+        if kind.startswith("discord"):
+            # Something reached Discord again: the re-published presence, or the next update
+            with self.ipc.lock:
+                return bool(self.ipc.activities) and self.ipc.activities[-1][0] > fault["ends"]
+        # Artwork is only searched for on a cache miss, so time from the first search after the fault instead
+        first = next((t for t in self.itunes.requested if t > fault["ends"]), None)
+        fault["observed"] = first is not None
+        if first is None:
+            return False
+        if self.itunes.answered and self.itunes.answered[-1] >= first:
+            fault["ends"] = first
+            return True
+        return False
+
+    def watch_recovery(self):
+        while not self.sampling.wait(0.02):
+            now = time.perf_counter()
+            for fault in self.faults:
+                if fault["recovered"] is not None:
+                    continue
+                if fault["ends"] is None:
+                    if self.ipc.garbage > 0:
+                        continue
+                    fault["ends"] = now
+                if now < fault["ends"]:
+                    continue
+                if fault["baseline"] is None:
+                    fault["baseline"] = self.app.reads
+                if self.recovered(fault):
+                    fault["recovered"] = now - fault["ends"]
+
+    def fault_report(self):
+        ms = lambda v: None if v is None else round(v * 1000, 1)
+        report = {}
+        for kind in FAULTS:
+            faults = [f for f in self.faults if f["kind"] == kind]
+            if not faults:
+                continue
+            times = [f["recovered"] for f in faults if f["recovered"] is not None]
+            report[kind] = {
+                "injected": len(faults),
+                "recovered": len(times),
+                # Nothing needed the dependency again before the session ended
+                "unobserved": sum(1 for f in faults if not f.get("observed", True)),
+                "recovery_ms": {"p50": ms(percentile(times, 0.5)), "p95": ms(percentile(times, 0.95)),
+                                "max": ms(max(times, default=None))},
+            }
+        return report
+
+    def resource_growth(self):
+        """ Thread, handle and RSS trend over the run, ignoring the first fifth as warm-up. """
+        samples = self.resource_samples
+        if len(samples) < 5:
+            return None
+        settled = samples[len(samples) // 5:]
+        (t0, rss0, threads0, fds0), (t1, rss1, threads1, fds1) = settled[0], settled[-1]
+        session_hours = max(t1 - t0, 1e-6) * self.speed / 3600
+        return {
+            "samples": len(samples),
+            "rss_mb_per_session_hour": None if rss0 is None else round((rss1 - rss0) / (1024 * 1024) / session_hours, 2),
+            "threads_max": max(s[2] for s in samples),
+            "threads_settled": [threads0, threads1],
+            "handles_max": None if fds0 is None else max(s[3] for s in samples),
+            "handles_settled": [fds0, fds1],
+        }
+
+    def final_state(self):
+        """ Anything still stuck once the session is over. """
+        worker = self.worker
+        publisher = worker.publisher
+        return {
+            "discord": worker.discord.state if worker.discord else None,
+            "mediamonkey": worker.watcher.endpoint.state,
+            "art_lookups_in_flight": len(worker.art_fetcher.in_flight),
+            # A payload waiting on the rate limit has a flush scheduled; one without is stuck
+            "presence_stuck": bool(publisher) and publisher.pending is not publisher.NOTHING and worker.next_flush is None,
+        }
+
+    def footprint(self):
+        if psutil is None:
+            return {"rss": None, "threads": threading.active_count(), "fds": None}
+        process = psutil.Process()
+        handles = process.num_handles() if hasattr(process, "num_handles") else process.num_fds()
+        return {"rss": process.memory_info().rss, "threads": process.num_threads(), "fds": handles}
+
+    def run(self, idle=0.0):
+        before = self.footprint()
+        self.worker.launched = time.perf_counter()
+        self.worker.start()
+        self.worker.send("start")
+        deadline = time.monotonic() + 5
+        while not self.worker.is_running and time.monotonic() < deadline:
+            time.sleep(0.01)
+        if not self.worker.is_running:
+            raise RuntimeError("worker did not connect to the fake Discord IPC socket")
+        threading.Thread(target=self.sample_memory, name="RssSampler", daemon=True).start()
+        threading.Thread(target=self.watch_recovery, name="FaultWatch", daemon=True).start()
+
+        cpu_start = time.process_time()
+        self.started = time.perf_counter()
+        for event in self.events:
+            delay = self.started + event["t"] / self.speed - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            if event["type"] == "end":
+                break
+            if event["type"] == "play":
+                self.track_changes.append((time.perf_counter(), event["track"]))
+            if event["type"] in FAULTS:
+                self.inject(event)
+            else:
+                self.app.apply(event)
+        replay_wall = time.perf_counter() - self.started
+        replay_cpu = time.process_time() - cpu_start
+        watcher = self.worker.watcher
+        polling = self.polling_report(watcher, replay_wall)
+
+        idle_cpu = None
+        if idle > 0:
+            self.app.apply({"type": "stop"})
+            time.sleep(1.0)
+            idle_start = time.process_time()
+            wakeups_start = watcher.wakeups
+            time.sleep(idle)
+            idle_cpu = (time.process_time() - idle_start) / idle * 3600
+            polling["idle_wakeups_per_session_hour"] = round((watcher.wakeups - wakeups_start) / (idle * self.speed) * 3600)
+
+        publisher = self.worker.publisher
+        presence_stats = dict(publisher.stats) if publisher else {}
+        metrics = self.worker.metrics.snapshot()
+        after = self.footprint()
+        soak = None
+        if self.faults:
+            # Give the last fault a moment to clear before judging what is still stuck
+            time.sleep(2.0)
+            soak = {"faults": self.fault_report(), "final_state": self.final_state(), "growth": self.resource_growth()}
+        self.worker.send("stop")
+        self.worker.send("quit")
+        self.worker.join(timeout=5)
+        self.sampling.set()
+        self.ipc.close()
+        self.itunes.shutdown()
+        report = self.report(before, after, replay_wall, replay_cpu, idle_cpu, presence_stats, polling, metrics)
+        if soak:
+            report["soak"] = soak
+        return report
+
+    def polling_report(self, watcher, replay_wall):
+        """ Watcher wakeups per hour of session time and how long changes went unseen (session ms). """
+        scheduler = watcher.scheduler
+        gaps = list(scheduler.gaps)
+        ms = lambda v: None if v is None else round(v * 1000, 1)
+        return {
+            "mode": "events" if watcher.source.events_enabled else "poll",
+            "wakeups": watcher.wakeups,
+            "wakeups_per_session_hour": round(watcher.wakeups / max(replay_wall * self.speed, 1.0) * 3600),
+            "idle_wakeups_per_session_hour": None,
+            "seeks_detected": scheduler.stats["seeks"],
+            "end_aligned": scheduler.stats["end_aligned"],
+            "detection_bound_ms": {
+                "p50": ms(percentile(gaps, 0.5)),
+                "p95": ms(percentile(gaps, 0.95)),
+            },
+        }
+
+    def report(self, before, after, replay_wall, replay_cpu, idle_cpu, presence_stats, polling, metrics):
+        with self.ipc.lock:
+            activities = list(self.ipc.activities)
+        presence_latency = []
+        art_latency = []
+        dropped = 0
+        placeholder_first = 0
+        wrong_art = 0
+        for i, (changed_at, track) in enumerate(self.track_changes):
+            until = self.track_changes[i + 1][0] if i + 1 < len(self.track_changes) else float("inf")
+            shown = [(t, a) for t, a in activities if a and a.get("details") == track["title"] and changed_at <= t < until]
+            if not shown:
+                dropped += 1
+                continue
+            presence_latency.append(shown[0][0] - changed_at)
+            # Stand-in artwork URLs name their album, so a karaoke or previous album's cover counts as wrong
+            own_art = "/art/" + urllib.parse.quote(f"{track['artist']} {track['album']}") + "/"
+            images = [(t, a.get("assets", {}).get("large_image", "logo")) for t, a in shown]
+            wrong_art += sum(1 for _, image in images if image != "logo" and own_art not in image)
+            with_art = [t for t, image in images if own_art in image]
+            if with_art and with_art[0] != shown[0][0]:
+                placeholder_first += 1
+            if with_art:
+                art_latency.append(with_art[0] - changed_at)
+        tracks = len(self.track_changes)
+        ms = lambda v: None if v is None else round(v * 1000, 1)
+        return {
+            "tracks": tracks,
+            "albums": len({(t["artist"], t["album"]) for _, t in self.track_changes}),
+            "replay_seconds": round(replay_wall, 2),
+            "first_presence_ms": None if self.worker.first_presence is None else round(self.worker.first_presence * 1000, 1),
+            "presence_latency_ms": {
+                "p50": ms(percentile(presence_latency, 0.5)),
+                "p95": ms(percentile(presence_latency, 0.95)),
+                "max": ms(max(presence_latency, default=None)),
+                "not_shown": dropped,
+            },
+            "art_latency_ms": {
+                "p50": ms(percentile(art_latency, 0.5)),
+                "p95": ms(percentile(art_latency, 0.95)),
+                "placeholder_first": placeholder_first,
+                "wrong_art": wrong_art,
+            },
+            "discord": {"activities": len(activities), "connections": self.ipc.connections, **presence_stats},
+            "network": {
+                **self.itunes.counts,
+                "per_track": round((self.itunes.counts["search"] + self.itunes.counts["art"]) / max(1, tracks), 2),
+            },
+            "com_calls": {
+                "total": self.app.calls,
+                "per_read": round(self.app.calls / max(1, self.app.reads), 2),
+                "per_track": round(self.app.calls / max(1, tracks), 1),
+            },
+            "polling": polling,
+            "stages_ms": {
+                name: {"p50": h["p50_ms"], "p95": h["p95_ms"], "max": h["max_ms"]}
+                for name, h in sorted(metrics["histograms"].items())
+            },
+            "exceptions": {stage: e["count"] for stage, e in metrics["exceptions"].items()},
+            "art_cache_hit_ratio": metrics["sources"]["art_cache"]["hit_ratio"],
+            "prefetch": metrics["sources"]["prefetch"],
+            "art_matching": metrics["sources"]["art_matching"],
+            "journal": {
+                "plays": len(self.journal),
+                "session_minutes": round(sum(self.journal.listened) / 60, 1),
+                "top_album": (self.journal.top("album", limit=1) or [None])[0],
+            },
+            "cpu": {
+                "replay_seconds": round(replay_cpu, 3),
+                "idle_seconds_per_hour": None if idle_cpu is None else round(idle_cpu, 2),
+            },
+            "memory": {
+                "rss_start_mb": mb(before["rss"]),
+                "rss_peak_mb": mb(max(self.rss_samples, default=None)),
+                "rss_end_mb": mb(after["rss"]),
+                "threads_start": before["threads"],
+                "threads_end": after["threads"],
+                "handles_start": before["fds"],
+                "handles_end": after["fds"],
+            },
+        }
+
+def mb(value):
+    return None if value is None else round(value / (1024 * 1024), 1)
+
+def print_report(report, indent=""):
+    for key, value in report.items():
+        if isinstance(value, dict):
+            print(f"{indent}{key}:")
+            print_report(value, indent + "  ")
+        else:
+            print(f"{indent}{key}: {value}")
+
+# --- MICRO-BENCHMARKS ---
+def legacy_payload(artist, title, album, art_url, start, end):
+    """ The per-tick dict update_discord built before PresenceBuilder, kept as the baseline. """
+    yt_query = urllib.parse.quote(f"{artist} - {title}")
+    btns = [{"label": "Listen on YouTube", "url": f"https://www.youtube.com/results?search_query={yt_query}"}]
+    return dict(
+        state=f"by {artist}", details=f"{title}",
+        large_image=art_url, large_text=album,
+        small_image="play", small_text="Playing",
+        start=start, end=end, buttons=btns
+    )
+
+def payload_benchmark(ticks=200000, tracks=20, seed=1):
+    """ Per-tick cost of building a presence payload and comparing it with the last one sent. """
+    rng = random.Random(seed)
+    songs = [(f"Artist {rng.randrange(1000)} feat. Söme Ωne", f"Title {i} (Live at the Hall)", f"Album {i % 5} [Deluxe]")
+             for i in range(tracks)]
+    per_track = ticks // tracks
+    builder = PresenceBuilder()
+
+    def run(build):
+        last = None
+        began = time.perf_counter()
+        for artist, title, album in songs:
+            for tick in range(per_track):
+                payload = build(artist, title, album, "https://art.example/cover.jpg", 1700000000, 1700000215)
+                if payload == last:
+                    continue
+                last = payload
+        return (time.perf_counter() - began) / (per_track * len(songs)) * 1e9
+
+    legacy_ns = run(legacy_payload)
+    builder_ns = run(lambda *args: builder.build(*args))
+    info = builder.cache_info()
+    return {
+        "ticks": per_track * len(songs),
+        "legacy_ns_per_tick": round(legacy_ns),
+        "builder_ns_per_tick": round(builder_ns),
+        "speedup": round(legacy_ns / builder_ns, 1),
+        "track_cache_hits": info.hits,
+        "track_cache_misses": info.misses,
+    }
+
+# Library spelling, the provider album it should match (None: no right answer
+# in the results), and the search results in the order the provider ranked them
+MATCH_CORPUS = [
+    ("Daft Punk", "Random Access Memories (Deluxe Edition)", 1, [
+        ("Sing-Along Stars", "Random Access Memories (Karaoke Version)", 90), ("Daft Punk", "Random Access Memories", 1)]),
+    ("Beyonce", "Lemonade", 2, [("Beyoncé", "Lemonade", 2), ("Beyoncé", "4", 91)]),
+    ("Sigur Ros", "Takk...", 3, [("Sigur Rós", "Takk...", 3)]),
+    ("The Beatles", "Abbey Road - 2019 Remaster", 4, [
+        ("The Beatles Tribute Band", "Abbey Road Revisited", 92), ("The Beatles", "Abbey Road (Remastered)", 4)]),
+    ("Fleetwood Mac", "Rumours [Super Deluxe]", 5, [("Fleetwood Mac", "Rumours", 5), ("Fleetwood Mac", "Tusk", 93)]),
+    ("Mark Ronson feat. Bruno Mars", "Uptown Special", 6, [
+        ("Mark Ronson", "Uptown Special", 6), ("Bruno Mars", "24K Magic", 94)]),
+    ("Simon and Garfunkel", "Bridge Over Troubled Water", 7, [
+        ("Simon & Garfunkel", "Bridge Over Troubled Water", 7)]),
+    ("AC/DC", "Back in Black", 8, [("Various Artists", "Back in Black: A Tribute to AC/DC", 95), ("AC/DC", "Back In Black", 8)]),
+    ("Radiohead", "OK Computer OKNOTOK 1997 2017", 9, [("Radiohead", "OK Computer OKNOTOK 1997 2017", 9)]),
+    ("Bjork", "Homogenic", 10, [("Björk", "Homogenic", 10)]),
+    ("Local Band", "Garage Demos", None, [("Local Natives", "Gorilla Manor", 96)]),
+    ("Unknown Artist", "Live Bootleg", None, [("Taylor Swift", "Live from Clear Channel Stripped", 97)]),
+    ("Nirvana", "Nevermind (30th Anniversary)", 11, [
+        ("Nirvana Tribute", "Nevermind Lullabies", 98), ("Nirvana", "Nevermind", 11)]),
+    ("Guns N' Roses", "Appetite for Destruction", 12, [("Guns N' Roses", "Appetite For Destruction", 12)]),
+    # Another volume, sequel or expansion of the album is a different cover, not a near match
+    ("Led Zeppelin", "Led Zeppelin IV", 13, [("Led Zeppelin", "Led Zeppelin II", 99), ("Led Zeppelin", "Led Zeppelin IV", 13)]),
+    ("Led Zeppelin", "Led Zeppelin IV", None, [("Led Zeppelin", "Led Zeppelin II", 99)]),
+    ("Queen", "Greatest Hits", None, [("Queen", "Greatest Hits II", 100)]),
+    ("Radiohead", "Kid A", None, [("Radiohead", "Kid A Mnesia", 101)]),
+    ("Mastodon", "Leviathan", 14, [("Mastodon", "Leviathn", 14)]),
+    # Live, karaoke and other variant tags name a different release; reissue tags do not
+    ("Nirvana", "Nevermind", 11, [("Nirvana", "Nevermind (Live)", 102), ("Nirvana", "Nevermind (Deluxe Edition)", 11)]),
+    ("Weezer", "Weezer (Blue Album)", 15, [
+        ("Weezer", "Weezer (Green Album)", 103), ("Weezer", "Weezer (Blue Album) [Deluxe Edition]", 15)]),
+    ("Adele", "21", None, [("Adele", "21 (Karaoke Version)", 104), ("Adele", "21 (Live Deluxe Edition)", 105)]),
+]
+
+# Other spellings of corpus albums, which the alias index should answer without a search
+MATCH_VARIANTS = [
+    ("Daft Punk", "Random Access Memories"), ("Beyoncé", "Lemonade (Explicit)"), ("Sigur Rós", "Takk..."),
+    ("Beatles", "Abbey Road"), ("Fleetwood Mac", "Rumours"), ("Mark Ronson ft. Bruno Mars", "Uptown Special"),
+    ("Simon & Garfunkel", "Bridge over Troubled Water"), ("AC-DC", "Back In Black"), ("Björk", "Homogenic [Remastered]"),
+]
+
+def matching_benchmark():
+    """ Hit rate and precision of first-result matching versus AlbumMatcher, plus alias index reuse. """
+    matcher = AlbumMatcher()
+    answerable = sum(1 for _, _, expected, _ in MATCH_CORPUS if expected is not None)
+    scores = {}
+    for mode in ("first_result", "matcher"):
+        returned = correct = 0
+        for artist, album, expected, results in MATCH_CORPUS:
+            if mode == "first_result":
+                picked = results[0][2]
+            else:
+                picked = matcher.best(artist, album, results)
+            if picked is not None:
+                returned += 1
+                correct += picked == expected
+        scores[mode] = {
+            "hit_rate": round(correct / answerable, 3),
+            "precision": round(correct / returned, 3) if returned else None,
+            "wrong": returned - correct,
+        }
+    with tempfile.TemporaryDirectory() as directory:
+        aliases = AliasIndex(directory)
+        for artist, album, expected, results in MATCH_CORPUS:
+            picked = matcher.best(artist, album, results)
+            if picked is not None:
+                aliases.put(artist, album, ArtResult(f"https://art.example/{picked}.jpg", None, "itunes", f"itunes:{picked}"))
+        answered = sum(1 for artist, album in MATCH_VARIANTS if aliases.get(artist, album))
+    scores["alias_index"] = {
+        "variant_lookups": len(MATCH_VARIANTS),
+        "answered_without_search": answered,
+    }
+    return scores
+
+def http_check():
+    """ Drives HttpClient against the stand-in server's misbehaving endpoints and reports what it did. """
+    server = FakeItunesServer()
+    max_bytes = 256 * 1024
+    client = HttpClient(connect_timeout=1.0, read_timeout=0.5, total_timeout=1.0, retries=2, backoff=0.01,
+                        max_bytes=max_bytes)
+    base = f"{server.base_url}/http"
+
+    def attempt(path, **params):
+        """ (outcome, seconds, bytes read) of one get_bytes call. """
+        read_before = client.bytes_read
+        began = time.perf_counter()
+        try:
+            client.get_bytes(f"{base}/{path}", params=params)
+            outcome = "ok"
+        except ResponseTooLarge:
+            outcome = "too_large"
+        except requests.Timeout:
+            outcome = "timeout"
+        except requests.ConnectionError:
+            outcome = "connection_error"
+        except requests.HTTPError as e:
+            outcome = f"http_{e.response.status_code}"
+        return outcome, time.perf_counter() - began, client.bytes_read - read_before
+
+    checks = {}
+    try:
+        for status in (503, 429):
+            outcome, _, _ = attempt("flaky", key=f"retry{status}", status=status, fail=2)
+            checks[f"retry_{status}"] = {
+                "passed": outcome == "ok" and server.flaky[f"retry{status}"] == 3,
+                "outcome": outcome, "requests": server.flaky[f"retry{status}"],
+            }
+        outcome, _, _ = attempt("flaky", key="exhausted", status=500, fail=10)
+        checks["retries_exhausted"] = {
+            "passed": outcome == "http_500" and server.flaky["exhausted"] == 3,
+            "outcome": outcome, "requests": server.flaky["exhausted"],
+        }
+        outcome, _, read = attempt("large", size=max_bytes * 4)
+        checks["too_large_by_header"] = {"passed": outcome == "too_large" and read == 0, "outcome": outcome, "bytes_read": read}
+        outcome, _, read = attempt("stream", size=max_bytes * 4)
+        checks["too_large_streamed"] = {
+            "passed": outcome == "too_large" and read <= max_bytes + 64 * 1024,
+            "outcome": outcome, "bytes_read": read,
+        }
+        outcome, seconds, _ = attempt("slow", seconds=5)
+        checks["total_timeout"] = {
+            "passed": outcome == "timeout" and seconds < client.total_timeout + 0.5,
+            "outcome": outcome, "seconds": round(seconds, 2),
+        }
+        # Each attempt times out reading headers; the retries must still fit inside the one deadline
+        outcome, seconds, _ = attempt("stall", seconds=5)
+        checks["total_timeout_before_headers"] = {
+            "passed": outcome == "timeout" and seconds < client.total_timeout + 0.2,
+            "outcome": outcome, "seconds": round(seconds, 2),
+        }
+        connections = server.counts["connections"]
+        for i in range(20):
+            client.get_bytes(f"{server.base_url}/art/reuse{i}/100x100bb.jpg")
+        opened = server.counts["connections"] - connections
+        checks["keep_alive"] = {"passed": opened <= 1, "requests": 20, "connections_opened": opened}
+    finally:
+        client.close()
+        server.shutdown()
+        server.server_close()
+    return dict(checks, passed=all(check["passed"] for check in checks.values()))
+
+def quit_check(speed=20.0):
+    """ Quits a headless bridge through its control socket mid-track and checks that the journal kept every play. """
+    from feeble_headless import HeadlessBridge
+    workdir = tempfile.mkdtemp(prefix="feeble-quit-")
+    os.environ["XDG_RUNTIME_DIR"] = workdir
+    ipc = FakeDiscordIPC(os.path.join(workdir, "discord-ipc-0"))
+    itunes = FakeItunesServer({("Artist 1", "Album 1")})
+    tracks = [{"artist": "Artist 1", "title": f"Track {n}", "album": "Album 1", "path": "", "duration_ms": 120000}
+              for n in range(3)]
+    started = time.perf_counter()
+    app = FakeSDBApplication(lambda: (time.perf_counter() - started) * speed, tracks)
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    bridge = HeadlessBridge(
+        dict(DEFAULT_CONFIG, control_port=port), directory=workdir,
+        source_factory=lambda: FakeMediaMonkeySource(app),
+        remote_providers=[ItunesArtProvider(HttpClient(), base_url=itunes.base_url)], time_scale=speed
+    )
+    result = {}
+
+    def drive():
+        deadline = time.monotonic() + 5
+        while not bridge.worker.is_running and time.monotonic() < deadline:
+            time.sleep(0.01)
+        # Every play is still buffered (the journal flushes once a minute) when the quit arrives
+        for track in tracks:
+            app.apply({"type": "play", "track": track})
+            time.sleep(60 / speed)
+        try:
+            result["reply"] = send_command(port, "quit")
+        except (OSError, ValueError) as e:
+            result["reply"] = repr(e)
+            bridge.request_stop()
+
+    threading.Thread(target=drive, name="QuitCheck", daemon=True).start()
+    bridge.run_forever()
+    ipc.close()
+    itunes.shutdown()
+    plays = ListeningJournal(os.path.join(workdir, "journal")).listens()
+    titles = [play.title for play in plays]
+    return {
+        "quit_reply": result.get("reply"),
+        "journal_titles": titles,
+        "passed": result.get("reply") == {"ok": True} and titles == [t["title"] for t in tracks],
+    }
+
+def journal_benchmark(years=5, plays_per_day=60, seed=1):
+    """ Load and query times for a journal holding years of synthetic history. """
+    rng = random.Random(seed)
+    artists = [f"Artist {i}" for i in range(400)]
+    now = time.time()
+    start = now - years * 365 * 86400
+    step = 86400 / plays_per_day
+    with tempfile.TemporaryDirectory() as directory:
+        journal = ListeningJournal(directory)
+        began = time.perf_counter()
+        t = start
+        while t < now:
+            artist = rng.choice(artists)
+            album = f"{artist} Album {rng.randrange(5)}"
+            journal.append(t, rng.randint(5, 400), artist, f"Track {rng.randrange(20)}", album, "remote")
+            t += step
+        journal.flush()
+        append_us = (time.perf_counter() - began) / len(journal) * 1e6
+        size = os.path.getsize(journal.records_path) + os.path.getsize(journal.strings_path)
+
+        def timed(fn, repeat=5):
+            began = time.perf_counter()
+            for _ in range(repeat):
+                fn()
+            return round((time.perf_counter() - began) / repeat * 1000, 2)
+
+        return {
+            "plays": len(journal),
+            "file_mb": round(size / (1024 * 1024), 2),
+            "append_us": round(append_us, 2),
+            "load_ms": timed(lambda: len(ListeningJournal(directory)), repeat=1),
+            "top_artists_all_time_ms": timed(lambda: journal.top("artist")),
+            "top_albums_last_week_ms": timed(lambda: journal.top("album", since=now - 7 * 86400)),
+            "range_last_month_ms": timed(lambda: journal.listens(now - 30 * 86400, now)),
+            "stats_text_ms": timed(lambda: journal.stats_text("Artist 7")),
+        }
+
+# --- RECORDER ---
+class RecordingSource:
+    """ Wraps a live player source and appends what it observes to a session file. """
+    def __init__(self, source, out, seek_tolerance_ms=2000):
+        self.source = source
+        self.out = out
+        self.seek_tolerance_ms = seek_tolerance_ms
+        self.started = time.monotonic()
+        self.last = None
+        self.last_read = None
+        self.outage_started = None
+        # Where the track was paused (ms), while it is paused rather than stopped
+        self.paused_at = None
+
+    @property
+    def events_enabled(self):
+        return self.source.events_enabled
+
+    def now(self):
+        return round(time.monotonic() - self.started, 3)
+
+    def write(self, event):
+        self.out.write(json.dumps(event) + "\n")
+        self.out.flush()
+
+    def connect(self):
+        try:
+            return self.source.connect()
+        except Exception:
+            self.mark_outage()
+            raise
+
+    def probe(self):
+        alive = self.source.probe()
+        if not alive:
+            self.mark_outage()
+        return alive
+
+    def pump(self):
+        self.source.pump()
+
+    def take_events(self):
+        return self.source.take_events()
+
+    def disconnect(self):
+        self.source.disconnect()
+
+    def is_paused(self):
+        """ Idle snapshots cover both pause and stop; only the player knows which this is. """
+        mm = getattr(self.source, "mm", None)
+        try:
+            return bool(mm is not None and mm.Player.IsPaused)
+        except Exception:
+            return False
+
+    def mark_outage(self):
+        if self.outage_started is None:
+            self.outage_started = self.now()
+
+    def read_state(self):
+        try:
+            state = self.source.read_state()
+        except Exception:
+            self.mark_outage()
+            raise
+        now = self.now()
+        if self.outage_started is not None:
+            self.write({"t": self.outage_started, "type": "com_error", "duration": round(now - self.outage_started, 3)})
+            self.outage_started = None
+        last = self.last
+        if state.playing:
+            same_track = last is not None and (last.artist, last.title, last.album) == (state.artist, state.title, state.album)
+            if same_track and self.paused_at is not None:
+                # The same song carrying on after a pause is a resume, not a new play
+                self.write({"t": now, "type": "resume"})
+                if abs(state.position_ms - self.paused_at) > self.seek_tolerance_ms:
+                    self.write({"t": now, "type": "seek", "position_ms": state.position_ms})
+            elif not same_track or not self.last_read[1].playing:
+                self.write({"t": now, "type": "play", "position_ms": state.position_ms, "track": {
+                    "artist": state.artist, "title": state.title, "album": state.album,
+                    "path": state.path, "duration_ms": state.duration_ms,
+                }})
+            else:
+                expected = last.position_ms + (now - self.last_read[0]) * 1000
+                if abs(state.position_ms - expected) > self.seek_tolerance_ms:
+                    self.write({"t": now, "type": "seek", "position_ms": state.position_ms})
+            self.paused_at = None
+            self.last = state
+        elif self.last_read and self.last_read[1].playing:
+            if self.is_paused():
+                self.paused_at = last.position_ms + (now - self.last_read[0]) * 1000
+                self.write({"t": now, "type": "pause"})
+            else:
+                self.write({"t": now, "type": "stop"})
+        self.last_read = (now, state)
+        return state
+
+def record_session(path, duration, interval=0.5):
+    """ Records a live MediaMonkey session in the replay format (Windows only). """
+    if pythoncom is None:
+        raise SystemExit("Recording needs pywin32 and a running MediaMonkey 5.")
+    pythoncom.CoInitialize()
+    with open(path, "w", encoding="utf-8") as out:
+        source = RecordingSource(MediaMonkeySource(), out)
+        watcher = PlayerWatcher(source, lambda state: None, scheduler=AdaptiveScheduler(interval, interval, interval))
+        end = time.monotonic() + duration
+        while time.monotonic() < end:
+            time.sleep(min(watcher.step(), max(0.0, end - time.monotonic())))
+        source.write({"t": source.now(), "type": "end"})
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay MediaMonkey sessions through the bridge and report benchmarks.")
+    parser.add_argument("session", nargs="?", help="session .jsonl file to replay")
+    parser.add_argument("--synthetic", type=int, metavar="TRACKS", help="replay a generated session with this many tracks")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--soak", type=float, metavar="HOURS", help="replay this many session hours with injected faults")
+    parser.add_argument("--speed", type=float, default=20.0, help="session seconds per wall-clock second")
+    parser.add_argument("--poll", action="store_true", help="disable player events and use the polling fallback")
+    parser.add_argument("--idle", type=float, default=0.0, metavar="SECONDS", help="measure idle CPU for this long after the replay")
+    parser.add_argument("--write-session", metavar="PATH", help="save the generated session and exit")
+    parser.add_argument("--record", metavar="PATH", help="record a live MediaMonkey session instead of replaying")
+    parser.add_argument("--duration", type=float, default=3600.0, help="recording length in seconds")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("--no-prefetch", action="store_true", help="disable artwork prefetch from the Now Playing queue")
+    parser.add_argument("--bench-payload", action="store_true", help="time presence payload building per tick and exit")
+    parser.add_argument("--bench-matching", action="store_true", help="report artwork match hit rate and precision on a sample corpus and exit")
+    parser.add_argument("--bench-journal", action="store_true", help="time listening journal loads and queries over 5 years of history and exit")
+    parser.add_argument("--check-quit", action="store_true", help="quit a headless bridge over its control socket mid-track, check the journal kept every play and exit")
+    parser.add_argument("--check-http", action="store_true", help="check HttpClient retries, size limits, deadline and keep-alive against a local server and exit")
+    args = parser.parse_args(argv)
+
+    if args.record:
+        record_session(args.record, args.duration)
+        return 0
+    benchmarks = {"bench_payload": payload_benchmark, "bench_matching": matching_benchmark,
+                  "bench_journal": journal_benchmark, "check_http": http_check,
+                  "check_quit": quit_check}
+    chosen = [fn for name, fn in benchmarks.items() if getattr(args, name)]
+    if chosen:
+        report = chosen[0]()
+        if args.json:
+            print(json.dumps(report, indent=2))
+        else:
+            print_report(report)
+        return 1 if report.get("passed") is False else 0
+    if args.session:
+        events = load_session(args.session)
+    elif args.soak:
+        events = soak_session(args.soak, seed=args.seed)
+    else:
+        events = synthetic_session(args.synthetic or 40, seed=args.seed)
+    if args.write_session:
+        save_session(args.write_session, events)
+        return 0
+
+    # Short timeouts, so a stalled artwork search fails within the accelerated session instead of after minutes
+    http = HttpClient(connect_timeout=1.0, read_timeout=1.0, total_timeout=3.0, retries=0) if args.soak else None
+    # Prefetch would look the soak's fresh albums up before an iTunes fault even starts
+    report = ReplayHarness(
+        events, speed=args.speed, use_events=not args.poll,
+        config={"prefetch_depth": 0} if args.no_prefetch or args.soak else None, http=http
+    ).run(idle=args.idle)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())